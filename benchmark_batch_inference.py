@@ -0,0 +1,56 @@
+import argparse
+import time
+
+import numpy as np
+
+from inference_backend import BACKENDS, load_detector
+
+
+def make_frames(count, width, height, seed=0):
+    """
+    Create synthetic BGR frames of the given size.
+    """
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def benchmark(detector, frames, batch_size, warmup=2):
+    """
+    Run the frames through the detector in batches and return frames per second
+    and the mean latency of one batch in milliseconds.
+    """
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    for batch in batches[:warmup]:
+        detector.detect(batch)
+
+    start = time.perf_counter()
+    for batch in batches:
+        detector.detect(batch)
+    elapsed = time.perf_counter() - start
+    return len(frames) / elapsed, elapsed * 1000 / len(batches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare YOLO throughput for different inference batch sizes.")
+    parser.add_argument("--model", default="yolov8m.pt", help="Model weights to benchmark")
+    parser.add_argument("--backend", default="pytorch", choices=BACKENDS, help="Inference backend")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16", help="Comma separated batch sizes")
+    parser.add_argument("--frames", type=int, default=64, help="Number of frames per run")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    args = parser.parse_args()
+
+    detector = load_detector(args.model, backend=args.backend)
+    frames = make_frames(args.frames, args.width, args.height)
+
+    print(f"Model: {args.model} ({args.backend}), frames: {args.frames}, size: {args.width}x{args.height}")
+    print(f"{'batch':>6} {'frames/s':>10} {'ms/batch':>10} {'speedup':>8}")
+    baseline = None
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        fps, batch_ms = benchmark(detector, frames, batch_size)
+        baseline = baseline or fps
+        print(f"{batch_size:>6} {fps:>10.2f} {batch_ms:>10.1f} {fps / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import time
+
+import numpy as np
+
+from benchmark_batch_inference import make_frames
+from inference_backend import BACKENDS, INFERENCE_SIZE, load_detector
+
+
+def benchmark(detector, frames, batch_size):
+    """
+    Run the frames through the detector in batches and return frames per
+    second and the p50 and p95 latency of one batch in milliseconds.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch_size):
+        batch_start = time.perf_counter()
+        detector.detect(frames[i:i + batch_size])
+        latencies.append((time.perf_counter() - batch_start) * 1000)
+    elapsed = time.perf_counter() - start
+    return len(frames) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare YOLO latency and throughput per inference backend.")
+    parser.add_argument("--model", default="yolov8m.pt", help="Model weights to benchmark, exported as needed")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma separated backends")
+    parser.add_argument("--int8", action="store_true", help="Also benchmark the INT8 variant of exported backends")
+    parser.add_argument("--threads", type=int, default=0, help="Inference threads, 0 lets the backend decide")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--size", type=int, default=INFERENCE_SIZE, help="Inference input size")
+    parser.add_argument("--warmup", type=int, default=2, help="Warm-up inferences after loading")
+    parser.add_argument("--frames", type=int, default=64, help="Number of frames per run")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    args = parser.parse_args()
+
+    variants = []
+    for backend in args.backends.split(","):
+        variants.append((backend, False))
+        if args.int8 and backend != "pytorch":
+            variants.append((backend, True))
+    frames = make_frames(args.frames, args.width, args.height)
+
+    print(f"Model: {args.model}, frames: {args.frames}, size: {args.width}x{args.height}, batch: {args.batch_size}, threads: {args.threads or 'auto'}")
+    print(f"{'backend':>14} {'load s':>8} {'warmup s':>9} {'frames/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for backend, int8 in variants:
+        name = f"{backend}{'-int8' if int8 else ''}"
+        try:
+            start = time.perf_counter()
+            detector = load_detector(args.model, backend=backend, int8=int8, threads=args.threads, size=args.size, warmup=0)
+            load_seconds = time.perf_counter() - start
+            detector.warmup(args.warmup)
+            fps, p50, p95 = benchmark(detector, frames, args.batch_size)
+        except Exception as e:
+            print(f"{name:>14} failed: {e}")
+            continue
+        print(f"{name:>14} {load_seconds:>8.2f} {detector.warmup_seconds:>9.2f} {fps:>10.2f} {p50:>8.1f} {p95:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import pickle
+import time
+
+import numpy as np
+
+from benchmark_batch_inference import make_frames
+from frame_codec import encode_frame
+from message_schema import pack_message, unpack_message
+from remote_logging import make_log_message
+
+
+def make_messages(width, height):
+    """
+    Build one message of every queue, shaped like the services send them.
+    """
+    frame = make_frames(1, width, height)[0]
+    # Random noise compresses badly, a smooth frame is closer to a camera image
+    frame = np.ascontiguousarray(np.broadcast_to(np.linspace(0, 255, width, dtype=np.uint8)[None, :, None], frame.shape))
+    envelope = encode_frame(frame)
+    return {
+        "camera_details": {
+            "CameraId": 12, "CameraIp": "10.0.0.12", "CameraUrl": "rtsp://10.0.0.12/stream1",
+            "ObjectList": "['car', 'without helmet']", "Running": "TRUE", "UserId": 3, "CreditId": 7,
+            "Options": {"FrameCodec": "jpeg", "FrameQuality": 80, "MotionThreshold": 0.02, "Roi": [[0.1, 0.2], [0.9, 0.2], [0.9, 0.9], [0.1, 0.9]]},
+        },
+        "all_frames": {
+            "camera_id": 12, "camera_ip": "10.0.0.12", "object_list": "['car', 'without helmet']",
+            "datetime": "2024-01-01 12:00:00", "frame": envelope, "user_id": 3, "credit_id": 7,
+            "tracking": True, "roi": None, "inference_size": 640,
+        },
+        "video_analytics": {
+            "Event_Type": "Analytics", "CameraId": 12, "CameraIp": "10.0.0.12", "Datetime": "2024-01-01 12:00:00",
+            "Image": envelope, "Object": {"car": 3, "Without Helmet": 1}, "UserId": 3, "CreditId": 7,
+        },
+        "detected_vehicle": {"camera_id": 12, "frame": frame},
+        "anpr_logs": make_log_message("INFO", "Start threads for send frames", "Sent a frame from camera 12 (Process ID: 4242)"),
+    }
+
+
+def time_per_call(function, argument, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(argument)
+    return (time.perf_counter() - start) * 1e6 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pickle with the queue message schema for each queue's messages.")
+    parser.add_argument("--repeat", type=int, default=2000, help="Calls per measurement")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    args = parser.parse_args()
+
+    print(f"{'queue':>16} {'format':>7} {'bytes':>10} {'pack us':>9} {'unpack us':>10}")
+    for queue_name, message in make_messages(args.width, args.height).items():
+        for name, pack, unpack in (("pickle", pickle.dumps, pickle.loads), ("schema", pack_message, unpack_message)):
+            body = pack(message)
+            pack_us = time_per_call(pack, message, args.repeat)
+            unpack_us = time_per_call(unpack, body, args.repeat)
+            print(f"{queue_name:>16} {name:>7} {len(body):>10} {pack_us:>9.1f} {unpack_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,527 @@
+import argparse
+import collections
+import datetime
+import http.server
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker
+
+import cv2
+import numpy as np
+
+from message_schema import unpack_message
+from metrics import CAMERA_FRAMES, STAGE_SECONDS
+from rabbitmq_queues import FRAMES_QUEUE_MAX_LENGTH
+
+FRAMES_QUEUE = "all_frames"
+EVENTS_QUEUE = "video_analytics"
+# Put on a queue after the last message of the run
+END_OF_RUN = None
+RESULTS_DIR = "benchmark_results"
+SYNTHETIC_FPS = 25
+# Give up on a run whose stages stop reporting for this long, in seconds
+STAGE_TIMEOUT = 600
+# Settings read from the environment by the services, recorded with the results
+ENV_SETTINGS = (
+    "FRAME_TRANSPORT", "SHM_SLOTS", "FRAMES_QUEUE_MAX_LENGTH", "BATCH_SIZE", "BATCH_TIMEOUT_MS",
+    "INFERENCE_BACKEND", "INFERENCE_INT8", "INFERENCE_THREADS", "INFERENCE_SIZE",
+)
+
+
+class LocalBroker:
+    """
+    Stands in for RabbitMQ: one multiprocessing queue per queue name, shared
+    by the stage processes. A max length of 0 leaves the queue unbounded.
+    """
+
+    def __init__(self, context, max_lengths):
+        self.queues = {name: context.Queue(maxsize=max_length) for name, max_length in max_lengths.items()}
+
+    def publish(self, queue_name, body, block=False):
+        """Put a message on the queue, return False if the queue is full."""
+        try:
+            self.queues[queue_name].put(body, block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def get(self, queue_name, timeout=None):
+        return self.queues[queue_name].get(timeout=timeout)
+
+    def pending(self, queue_name):
+        return self.queues[queue_name].qsize()
+
+
+class BrokerPublisher:
+    """
+    Stands in for the sender's FramePublisher. Frames over the queue's max
+    length are rejected, like with the reject-publish overflow policy.
+
+    A camera is stopped after max_frames frames, once the frames queue has
+    drained so that its shared memory ring outlives the frames still queued.
+    """
+
+    def __init__(self, broker, queue_name, stop_events, max_frames):
+        self.broker = broker
+        self.queue_name = queue_name
+        self.stop_events = stop_events
+        self.max_frames = max_frames
+        self.lock = threading.Lock()
+        self.sent = collections.Counter()
+        self.last_publish = None
+
+    def publish(self, camera_id, body):
+        published = self.broker.publish(self.queue_name, body)
+        CAMERA_FRAMES.inc(camera=camera_id, step="published" if published else "rejected")
+        with self.lock:
+            self.sent[camera_id] += 1
+            self.last_publish = time.time()
+            done = self.sent[camera_id] >= self.max_frames
+        if done:
+            while self.broker.pending(self.queue_name):
+                time.sleep(0.05)
+            time.sleep(1)  # Let analytics attach to the frames it already took
+            self.stop_events[camera_id].set()
+
+    def close(self):
+        pass
+
+
+class BrokerChannel:
+    """
+    Stands in for the analytics' processed channel. Messages for queues
+    without a consumer in the benchmark are only counted.
+    """
+    is_open = True
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.discarded = collections.Counter()
+
+    def basic_publish(self, exchange, routing_key, body):
+        if routing_key in self.broker.queues:
+            self.broker.publish(routing_key, body, block=True)
+        else:
+            self.discarded[routing_key] += 1
+
+
+class SyntheticDetector:
+    """
+    Stands in for the models to measure the pipeline without inference. Every
+    frame gets a person and one to three cars; the car count changes every
+    25 frames, so some events are alerted and the rest deduplicated.
+    """
+    backend = "synthetic"
+
+    def __init__(self, names):
+        self.names = names
+        self.class_ids = {name: class_id for class_id, name in names.items()}
+        self.calls = 0
+
+    def detect(self, images, size=None):
+        results = []
+        for image in images:
+            self.calls += 1
+            height, width = image.shape[:2]
+            boxes = [[0.05 * width, 0.5 * height, 0.2 * width, 0.95 * height, 0.9, self.class_ids["person"]]]
+            for i in range(1 + self.calls // 25 % 3):
+                x = 0.3 + 0.22 * i
+                boxes.append([x * width, 0.4 * height, (x + 0.18) * width, 0.7 * height, 0.8, self.class_ids["car"]])
+            results.append(np.array(boxes, dtype=np.float32))
+        return results
+
+
+class MockApiHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every alert and credit request with 200 after the server's latency."""
+    protocol_version = "HTTP/1.1"  # Keep alive, like the real APIs
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests[self.path] += 1
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_api(latency):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MockApiHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.requests = collections.Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_synthetic_video(path, frames, width, height, fps=SYNTHETIC_FPS):
+    """
+    Write a video of a box moving over a gradient. Unlike noise it compresses
+    and passes the motion gate like a camera image.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not write synthetic video {path}")
+    background = np.empty((height, width, 3), dtype=np.uint8)
+    background[...] = np.linspace(40, 220, width, dtype=np.uint8)[None, :, None]
+    box = max(16, width // 8)
+    try:
+        for i in range(frames):
+            frame = background.copy()
+            x = i * 8 % (width - box)
+            cv2.rectangle(frame, (x, height // 3), (x + box, height // 3 + box), (0, 0, 255), -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def summarize_metrics():
+    """Return the mean latency of each stage and the frame counts by step recorded in this process."""
+    stages = {}
+    for (stage,), state in STAGE_SECONDS.values.items():
+        count = sum(state[:-1])
+        stages[stage] = {"count": count, "mean_ms": round(state[-1] * 1000 / count, 3) if count else None}
+    frames = collections.Counter()
+    for (camera, step), count in CAMERA_FRAMES.values.items():
+        frames[step] += count
+    return stages, dict(frames)
+
+
+def stage_result(stage, started, finished, cpu_start, items, latencies=()):
+    """Measure a stage process at the end of the run."""
+    seconds = max(finished - started, 1e-9)
+    cpu_seconds = time.process_time() - cpu_start
+    stages, frames = summarize_metrics()
+    return {
+        "stage": stage,
+        "started": started,
+        "finished": finished,
+        "items": items,
+        "seconds": round(seconds, 3),
+        "items_per_second": round(items / seconds, 2),
+        "cpu_seconds": round(cpu_seconds, 3),
+        "cpu_percent": round(cpu_seconds * 100 / seconds, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stage_seconds": stages,
+        "frames": frames,
+        "latencies": list(latencies),
+    }
+
+
+def _separate_resource_tracker():
+    # Spawned processes share their parent's resource tracker, which gets
+    # confused when one stage unregisters the shared memory another one
+    # created. The services run as separate programs with their own tracker.
+    resource_tracker._resource_tracker._fd = None
+
+
+def run_sender(broker, results, config):
+    """Replay the sources through process_video, one camera thread each."""
+    _separate_resource_tracker()
+    from vms_all_frame_sender import process_video
+
+    cameras = range(1, config["cameras"] + 1)
+    stop_events = {camera_id: threading.Event() for camera_id in cameras}
+    publisher = BrokerPublisher(broker, FRAMES_QUEUE, stop_events, config["frames"])
+    threads = []
+    started, cpu_start = time.time(), time.process_time()
+    for camera_id in cameras:
+        source = config["sources"][(camera_id - 1) % len(config["sources"])]
+        thread = threading.Thread(
+            target=process_video,
+            args=(source, camera_id, f"10.0.0.{camera_id}", config["object_list"], 1, 1, None, FRAMES_QUEUE, config["frame_interval"]),
+            kwargs={"retry_limit": 1, "options": config["options"], "publisher": publisher, "stop_event": stop_events[camera_id]},
+            daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    broker.publish(FRAMES_QUEUE, END_OF_RUN, block=True)
+    results.put(stage_result("sender", started, publisher.last_publish or time.time(), cpu_start, sum(publisher.sent.values())))
+
+
+def run_analytics(broker, results, config):
+    """Consume the frames in batches with process_batch, the body of process_frame."""
+    _separate_resource_tracker()
+    import vms_video_analytics as analytics
+
+    if config["synthetic_detections"]:
+        detector = SyntheticDetector({class_id: name.lower() for class_id, name in enumerate(analytics.Object_list)})
+        analytics.get_detector = lambda name: detector
+    else:
+        # Load the models up front, so the first frames do not pay for it
+        for name, rule in analytics.DETECTOR_RULES.items():
+            if rule is None or rule in config["object_list"]:
+                analytics.get_detector(name)
+    batch_size = config["batch_size"] or analytics.BATCH_SIZE
+    batch_timeout = (config["batch_timeout_ms"] or analytics.BATCH_TIMEOUT_MS) / 1000.0
+    channel = BrokerChannel(broker)
+    results.put(("ready", "analytics"))
+
+    latencies = []
+    items = 0
+    started = None
+    cpu_start = time.process_time()
+    body = broker.get(FRAMES_QUEUE)
+    while body is not END_OF_RUN:
+        if started is None:
+            started = time.time()
+        bodies = [body]
+        body = None
+        deadline = time.monotonic() + batch_timeout
+        while len(bodies) < batch_size:
+            try:
+                body = broker.get(FRAMES_QUEUE, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                body = None
+                break
+            if body is END_OF_RUN:
+                break
+            bodies.append(body)
+            body = None
+        analytics.process_batch(bodies, channel, EVENTS_QUEUE, None)
+        now = time.time()
+        for frame_body in bodies:
+            capture_time = unpack_message(frame_body).get("capture_time")
+            if capture_time is not None:
+                latencies.append(now - capture_time)
+        items += len(bodies)
+        if body is None:
+            body = broker.get(FRAMES_QUEUE)
+    finished = time.time()
+    broker.publish(EVENTS_QUEUE, END_OF_RUN, block=True)
+    result = stage_result("analytics", started or finished, finished, cpu_start, items, latencies)
+    result["discarded"] = dict(channel.discarded)
+    results.put(result)
+
+
+def run_writer(broker, results, config):
+    """Consume the events with write_analytics, against the mock APIs."""
+    import write_analytics1 as writer
+
+    writer.BaseUrl = config["api_url"]
+    writer.api_url = f"{config['api_url']}/transaction_update"
+    writer.save_frame = config["media_dir"]
+    results.put(("ready", "writer"))
+
+    latencies = []
+    items = 0
+    started = None
+    cpu_start = time.process_time()
+    while True:
+        body = broker.get(EVENTS_QUEUE)
+        if body is END_OF_RUN:
+            break
+        if started is None:
+            started = time.time()
+        writer.write_analytics(None, None, None, body)
+        capture_time = unpack_message(body).get("CaptureTime")
+        if capture_time is not None:
+            latencies.append(time.time() - capture_time)
+        items += 1
+    finished = time.time()
+    # Wait for the images and alerts still in flight
+    image_store = writer.get_image_store()
+    image_store.snapshot_executor.shutdown(wait=True)
+    image_store.executor.shutdown(wait=True)
+    if writer.alert_delivery is not None:
+        writer.alert_delivery.executor.shutdown(wait=True)
+    result = stage_result("writer", started or finished, finished, cpu_start, items, latencies)
+    result["drain_seconds"] = round(time.time() - finished, 3)
+    results.put(result)
+
+
+def receive(results, processes, count, timeout=STAGE_TIMEOUT):
+    """Return the next count messages of the stages, failing if a stage dies."""
+    messages = []
+    deadline = time.monotonic() + timeout
+    while len(messages) < count:
+        try:
+            messages.append(results.get(timeout=1))
+            deadline = time.monotonic() + timeout
+        except queue.Empty:
+            for process in processes:
+                if process.exitcode:
+                    raise RuntimeError(f"The {process.name} stage exited with code {process.exitcode}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"No stage reported for {timeout} seconds")
+    return messages
+
+
+def percentiles_ms(latencies):
+    if not latencies:
+        return {"p50": None, "p99": None}
+    return {f"p{q}": round(float(np.percentile(latencies, q)) * 1000, 1) for q in (50, 99)}
+
+
+def git_revision():
+    """Return the commit of the tree and whether it has uncommitted changes."""
+    def git(*args):
+        return subprocess.run(["git", *args], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    try:
+        return git("rev-parse", "HEAD") or None, bool(git("status", "--porcelain", "--untracked-files=no"))
+    except OSError:
+        return None, None
+
+
+def run_pipeline(config):
+    """Run the sender, analytics and writer as separate processes and return their results."""
+    context = multiprocessing.get_context("spawn")
+    broker = LocalBroker(context, {FRAMES_QUEUE: FRAMES_QUEUE_MAX_LENGTH, EVENTS_QUEUE: 0})
+    results = context.Queue()
+    consumers = [
+        context.Process(target=run_analytics, args=(broker, results, config), name="analytics"),
+        context.Process(target=run_writer, args=(broker, results, config), name="writer"),
+    ]
+    sender = context.Process(target=run_sender, args=(broker, results, config), name="sender")
+    processes = consumers + [sender]
+    try:
+        for process in consumers:
+            process.start()
+        receive(results, processes, len(consumers))
+        sender.start()
+        stages = {result["stage"]: result for result in receive(results, processes, len(processes))}
+        for process in processes:
+            process.join(timeout=30)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    return stages
+
+
+def build_report(args, stages, api):
+    commit, dirty = git_revision()
+    stages = {name: stages[name] for name in ("sender", "analytics", "writer")}
+    sender, analytics, writer = stages.values()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "args": vars(args),
+        "env": {name: os.environ[name] for name in ENV_SETTINGS if name in os.environ},
+        "frames_per_second": round(analytics["items"] / max(analytics["finished"] - sender["started"], 1e-9), 2),
+        "latency_ms": {
+            "capture_to_analysed": percentiles_ms(analytics.pop("latencies")),
+            "end_to_end": percentiles_ms(writer.pop("latencies")),
+        },
+        "http_requests": dict(api.requests),
+        "stages": stages,
+    }
+    sender.pop("latencies")
+    for stage in stages.values():
+        stage.pop("started")
+        stage.pop("finished")
+    return report
+
+
+def _lookup(report, *keys):
+    value = report
+    for key in keys:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def _change(value, old):
+    """Format the change from an earlier run's value, or nothing without one."""
+    if old is None or value is None:
+        return ""
+    return f" ({(value - old) * 100 / old:+.1f}% vs {old})" if old else f" (vs {old})"
+
+
+def print_report(report, baseline=None):
+    baseline = baseline or {}
+    if baseline:
+        print(f"Compared with {baseline.get('commit')} from {baseline.get('timestamp')}")
+    print(f"Pipeline: {report['frames_per_second']} frames/s{_change(report['frames_per_second'], baseline.get('frames_per_second'))}")
+    for name, latency in report["latency_ms"].items():
+        for q, value in latency.items():
+            print(f"  {name} {q}: {value} ms{_change(value, _lookup(baseline, 'latency_ms', name, q))}")
+    print(f"{'stage':>10} {'items':>7} {'items/s':>9} {'cpu %':>7} {'max rss MB':>11}")
+    for name, stage in report["stages"].items():
+        print(f"{name:>10} {stage['items']:>7} {stage['items_per_second']:>9} {stage['cpu_percent']:>7} {stage['max_rss_mb']:>11}")
+        if baseline:
+            print(f"{'':>10} cpu %{_change(stage['cpu_percent'], _lookup(baseline, 'stages', name, 'cpu_percent'))},"
+                  f" max rss MB{_change(stage['max_rss_mb'], _lookup(baseline, 'stages', name, 'max_rss_mb'))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay video through the sender, analytics and writer with a local broker and mock APIs.")
+    parser.add_argument("--source", action="append", help="Video file to replay, repeat for more; cameras take them in turn. Defaults to a synthetic video")
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=200, help="Frames sent per camera, at most what its source lasts")
+    parser.add_argument("--unpaced", action="store_true", help="Read the sources as fast as they decode instead of at their frame rate")
+    parser.add_argument("--frame-interval", type=int, default=1, help="Send every nth frame of the source")
+    parser.add_argument("--width", type=int, default=1280, help="Synthetic video width")
+    parser.add_argument("--height", type=int, default=720, help="Synthetic video height")
+    parser.add_argument("--object-list", default="['car', 'person']", help="Object list of every camera, as the API sends it")
+    parser.add_argument("--options", default="{}", help="Camera options as JSON, e.g. '{\"MotionThreshold\": 0.02}'")
+    parser.add_argument("--batch-size", type=int, default=None, help="Analytics batch size, defaults to BATCH_SIZE")
+    parser.add_argument("--batch-timeout-ms", type=int, default=None, help="Analytics batch timeout, defaults to BATCH_TIMEOUT_MS")
+    parser.add_argument("--synthetic-detections", action="store_true", help="Replace the models with fixed detections to measure the pipeline alone")
+    parser.add_argument("--http-latency-ms", type=float, default=20, help="Response time of the mock APIs")
+    parser.add_argument("--output", help=f"Results file, defaults to {RESULTS_DIR}/pipeline_<commit>_<time>.json")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    options = json.loads(args.options)
+    # Cameras read their sources like live streams unless told otherwise
+    options.setdefault("Realtime", not args.unpaced)
+    target_fps = float(options.get("TargetFps") or 0)
+    source_frames = int(args.frames * (SYNTHETIC_FPS / target_fps if target_fps else args.frame_interval)) + 1
+
+    api = start_mock_api(args.http_latency_ms / 1000)
+    with tempfile.TemporaryDirectory(prefix="vms_benchmark_") as work_dir:
+        sources = args.source or [write_synthetic_video(os.path.join(work_dir, "synthetic.mp4"), source_frames, args.width, args.height)]
+        config = {
+            "sources": sources,
+            "cameras": args.cameras,
+            "frames": args.frames,
+            "frame_interval": args.frame_interval,
+            "object_list": args.object_list.lower(),
+            "options": options,
+            "batch_size": args.batch_size,
+            "batch_timeout_ms": args.batch_timeout_ms,
+            "synthetic_detections": args.synthetic_detections,
+            "api_url": f"http://127.0.0.1:{api.server_address[1]}",
+            "media_dir": os.path.join(work_dir, "media"),
+        }
+        stages = run_pipeline(config)
+    api.shutdown()
+
+    report = build_report(args, stages, api)
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"pipeline_{(report['commit'] or 'unknown')[:8]}_{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w") as results_file:
+        json.dump(report, results_file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(report, baseline)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import collections
+import json
+import os
+import threading
+import time
+
+# Deduplication settings. ALERT_COOLDOWNS overrides the cooldown per event
+# type as JSON, e.g. '{"Without Helmet": 30, "Cattle": 300}'.
+ALERT_COOLDOWN = float(os.getenv("ALERT_COOLDOWN", "60"))
+ALERT_COOLDOWNS = json.loads(os.getenv("ALERT_COOLDOWNS", "{}"))
+ALERT_COUNT_CHANGE = int(os.getenv("ALERT_COUNT_CHANGE", "1"))
+ALERT_MAX_CAMERAS = int(os.getenv("ALERT_MAX_CAMERAS", "10000"))
+
+
+class EventDeduplicator:
+    """
+    Decide per camera whether an analytics event should raise an alert.
+
+    For every camera the last alerted count and time of each event type
+    (object label) is remembered. An event raises an alert when one of its
+    event types is new, its cooldown has expired, or its count changed by at
+    least count_change since the last alert. Otherwise it is suppressed.
+
+    State is kept for at most max_cameras cameras, the least recently seen
+    ones are forgotten first.
+    """
+
+    def __init__(self, cooldowns=None, default_cooldown=ALERT_COOLDOWN, count_change=ALERT_COUNT_CHANGE, max_cameras=ALERT_MAX_CAMERAS):
+        self.cooldowns = dict(ALERT_COOLDOWNS if cooldowns is None else cooldowns)
+        self.default_cooldown = default_cooldown
+        self.count_change = count_change
+        self.max_cameras = max_cameras
+        self.cameras = collections.OrderedDict()  # camera_id -> {event type: (count, alert time)}
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.suppressed_by_type = collections.Counter()
+
+    def _is_due(self, event_type, count, last, now):
+        if last is None:
+            return True
+        last_count, last_time = last
+        cooldown = self.cooldowns.get(event_type, self.default_cooldown)
+        return now - last_time >= cooldown or abs(count - last_count) >= self.count_change
+
+    def should_alert(self, camera_id, objects, now=None):
+        """
+        Return True if the event's objects ({event type: count}) should raise an alert.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            state = self.cameras.get(camera_id)
+            if state is None:
+                state = self.cameras[camera_id] = {}
+                if len(self.cameras) > self.max_cameras:
+                    self.cameras.popitem(last=False)
+                    self.counters["evicted"] += 1
+            else:
+                self.cameras.move_to_end(camera_id)
+
+            if any(self._is_due(event_type, count, state.get(event_type), now) for event_type, count in objects.items()):
+                for event_type, count in objects.items():
+                    state[event_type] = (count, now)
+                self.counters["alerted"] += 1
+                return True
+
+            self.counters["suppressed"] += 1
+            self.suppressed_by_type.update(objects.keys())
+            return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "alerted": self.counters["alerted"],
+                "suppressed": self.counters["suppressed"],
+                "evicted": self.counters["evicted"],
+                "cameras": len(self.cameras),
+                "suppressed_by_type": dict(self.suppressed_by_type),
+            }
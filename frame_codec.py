@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+
+# Version of the frame envelope sent on the 'all_frames' and 'video_analytics' queues
+FRAME_ENVELOPE_VERSION = 1
+
+# Supported payload codecs and the OpenCV extension used to encode them
+FRAME_CODECS = {
+    "jpeg": ".jpg",
+    "webp": ".webp",
+    "png": ".png",
+}
+
+# Default encode settings, overridden per camera through the camera details
+DEFAULT_FRAME_CODEC = "jpeg"
+DEFAULT_FRAME_QUALITY = 80
+DEFAULT_PNG_COMPRESSION = 3
+
+
+def get_encode_settings(options=None):
+    """
+    Build the frame encode settings from the per camera options.
+    """
+    options = options or {}
+    codec = str(options.get("FrameCodec") or DEFAULT_FRAME_CODEC).lower()
+    if codec == "jpg":
+        codec = "jpeg"
+    if codec not in FRAME_CODECS:
+        raise ValueError(f"Unsupported frame codec: {codec}")
+    quality = int(options.get("FrameQuality") or DEFAULT_FRAME_QUALITY)
+    return {"codec": codec, "quality": max(1, min(quality, 100))}
+
+
+def _encode_params(codec, quality):
+    if codec == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if codec == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    return [cv2.IMWRITE_PNG_COMPRESSION, DEFAULT_PNG_COMPRESSION]
+
+
+def encode_frame(frame, codec=DEFAULT_FRAME_CODEC, quality=DEFAULT_FRAME_QUALITY):
+    """
+    Compress a BGR frame into a versioned envelope with a small metadata header.
+    """
+    ok, buffer = cv2.imencode(FRAME_CODECS[codec], frame, _encode_params(codec, quality))
+    if not ok:
+        raise ValueError(f"Could not encode frame as {codec}")
+    height, width = frame.shape[:2]
+    return {
+        "version": FRAME_ENVELOPE_VERSION,
+        "codec": codec,
+        "quality": quality,
+        "width": width,
+        "height": height,
+        "data": buffer.tobytes(),
+    }
+
+
+def is_frame_envelope(value):
+    return isinstance(value, dict) and "version" in value and "data" in value
+
+
+def get_envelope_settings(value):
+    """
+    Return the encode settings a frame envelope, or a shared memory frame
+    descriptor, was sent with, so a processed frame can be sent on with the
+    same settings.
+    """
+    if isinstance(value, dict) and "codec" in value:
+        return {"codec": value["codec"], "quality": value.get("quality", DEFAULT_FRAME_QUALITY)}
+    return {"codec": DEFAULT_FRAME_CODEC, "quality": DEFAULT_FRAME_QUALITY}
+
+
+def decode_frame(value):
+    """
+    Decode a frame envelope back into a BGR ndarray.
+    Raw ndarrays from older senders are returned unchanged.
+    """
+    if isinstance(value, np.ndarray):
+        return value
+    if not is_frame_envelope(value):
+        raise ValueError("Message does not contain a frame envelope")
+    if value["version"] > FRAME_ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported frame envelope version: {value['version']}")
+    frame = cv2.imdecode(np.frombuffer(value["data"], dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError(f"Could not decode {value['codec']} frame")
+    return frame
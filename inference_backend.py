@@ -0,0 +1,284 @@
+import ast
+import collections
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+# Inference backend settings. "pytorch" runs the .pt weights through
+# ultralytics; "onnx" and "openvino" run exported versions of the same
+# weights, exporting them next to the .pt file on first use.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "pytorch")
+INFERENCE_INT8 = os.getenv("INFERENCE_INT8", "false").lower() in ("1", "true", "yes")
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))  # 0 lets the backend decide
+INFERENCE_SIZE = int(os.getenv("INFERENCE_SIZE", "640"))
+WARMUP_RUNS = int(os.getenv("WARMUP_RUNS", "2"))
+BACKENDS = ("pytorch", "onnx", "openvino")
+
+# Post-processing of exported models, matching the ultralytics defaults
+CONF_THRESHOLD = 0.25
+NMS_IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+PAD_VALUE = 114
+# Letterbox buffers kept per detector, one per (frame resolution, inference size)
+LETTERBOX_POOL_SIZE = 32
+
+
+def normalize_size(size, default=INFERENCE_SIZE):
+    """Round an inference size up to the multiple of 32 YOLO models need."""
+    size = int(size or default)
+    return max(32, math.ceil(size / 32) * 32)
+
+
+class LetterboxPool:
+    """
+    Preallocated letterbox buffers keyed by frame resolution and inference size.
+
+    letterbox() resizes an image into the buffers of its resolution and
+    returns the padded size x size image, which is only valid until the next
+    image of the same resolution. The padding is filled once, so a frame only
+    costs its resize and one copy.
+    """
+
+    def __init__(self, max_buffers=LETTERBOX_POOL_SIZE):
+        self.max_buffers = max_buffers
+        self.buffers = collections.OrderedDict()  # (height, width, size) -> (padded, resized, scale, pad)
+
+    def _buffers(self, height, width, size):
+        key = (height, width, size)
+        entry = self.buffers.get(key)
+        if entry is not None:
+            self.buffers.move_to_end(key)
+            return entry
+        scale = min(size / height, size / width)
+        new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+        padded = np.full((size, size, 3), PAD_VALUE, dtype=np.uint8)
+        resized = np.empty((new_height, new_width, 3), dtype=np.uint8)
+        entry = self.buffers[key] = (padded, resized, scale, ((size - new_width) // 2, (size - new_height) // 2))
+        if len(self.buffers) > self.max_buffers:
+            self.buffers.popitem(last=False)
+        return entry
+
+    def letterbox(self, image, size):
+        """
+        Resize an image to fit a size x size square, keeping its aspect ratio,
+        and pad the rest. Returns the padded image, the scale and the (x, y) padding.
+        """
+        height, width = image.shape[:2]
+        padded, resized, scale, (pad_x, pad_y) = self._buffers(height, width, size)
+        cv2.resize(image, (resized.shape[1], resized.shape[0]), dst=resized, interpolation=cv2.INTER_LINEAR)
+        padded[pad_y:pad_y + resized.shape[0], pad_x:pad_x + resized.shape[1]] = resized
+        return padded, scale, (pad_x, pad_y)
+
+
+def postprocess(output, scale, pad, image_shape, conf_threshold=CONF_THRESHOLD, iou_threshold=NMS_IOU_THRESHOLD, max_detections=MAX_DETECTIONS):
+    """
+    Decode one image's raw YOLOv8 output of shape (4 + classes, anchors) into
+    an (N, 6) array of [x1, y1, x2, y2, score, class_id] in image coordinates.
+    """
+    predictions = output.T
+    class_scores = predictions[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(class_ids)), class_ids]
+    keep = scores > conf_threshold
+    if not keep.any():
+        return np.empty((0, 6), dtype=np.float32)
+    centers, sizes, scores, class_ids = predictions[keep, 0:2], predictions[keep, 2:4], scores[keep], class_ids[keep]
+
+    xywh = np.concatenate([centers - sizes / 2, sizes], axis=1)
+    indices = np.asarray(cv2.dnn.NMSBoxesBatched(xywh.tolist(), scores.tolist(), class_ids.tolist(), conf_threshold, iou_threshold), dtype=np.int64).reshape(-1)[:max_detections]
+
+    boxes = np.empty((len(indices), 6), dtype=np.float32)
+    boxes[:, 0:2] = xywh[indices, 0:2]
+    boxes[:, 2:4] = xywh[indices, 0:2] + xywh[indices, 2:4]
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / scale).clip(0, image_shape[1])
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / scale).clip(0, image_shape[0])
+    boxes[:, 4] = scores[indices]
+    boxes[:, 5] = class_ids[indices]
+    return boxes
+
+
+class Detector:
+    """
+    A loaded detection model. detect() takes a list of BGR images and returns
+    one (N, 6) array of [x1, y1, x2, y2, score, class_id] per image in the
+    images' own coordinates; names maps class IDs to labels. The images are
+    resized to size, or the detector's default size, for inference.
+    """
+    backend = None
+
+    def __init__(self, size=INFERENCE_SIZE):
+        self.size = normalize_size(size)
+        self.names = {}
+        self.warmup_seconds = 0.0
+
+    def detect(self, images, size=None):
+        raise NotImplementedError
+
+    def warmup(self, runs=WARMUP_RUNS):
+        """Run a few inferences so the first frames don't pay for lazy initialisation."""
+        image = np.zeros((self.size, self.size, 3), dtype=np.uint8)
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.detect([image])
+        self.warmup_seconds = time.perf_counter() - start
+
+
+class TorchDetector(Detector):
+    """The .pt weights run through ultralytics and PyTorch."""
+    backend = "pytorch"
+
+    def __init__(self, weights, threads=INFERENCE_THREADS, size=INFERENCE_SIZE):
+        super().__init__(size)
+        import torch
+        from ultralytics import YOLO
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = YOLO(weights)
+        self.names = self.model.names
+
+    def detect(self, images, size=None):
+        size = normalize_size(size, self.size)
+        return [result.boxes.data.cpu().numpy() for result in self.model(images, imgsz=size, verbose=False)]
+
+
+class ExportedDetector(Detector):
+    """
+    Base of the exported model backends, which share the letterbox
+    pre-processing and the NMS post-processing. Letterbox and input buffers
+    are reused from call to call, so a detector must only be used from one
+    thread at a time.
+    """
+    # Images per forward pass, 1 for models exported with a static batch size
+    max_batch = 1
+
+    def __init__(self, size=INFERENCE_SIZE):
+        super().__init__(size)
+        self.letterbox_pool = LetterboxPool()
+        self.blobs = {}  # size -> float32 input buffer, grown to the largest batch
+
+    def _blob(self, count, size):
+        blob = self.blobs.get(size)
+        if blob is None or len(blob) < count:
+            blob = self.blobs[size] = np.empty((count, 3, size, size), dtype=np.float32)
+        return blob[:count]
+
+    def _forward(self, blob):
+        """Run an (N, 3, size, size) float32 blob and return the (N, 4 + classes, anchors) output."""
+        raise NotImplementedError
+
+    def detect(self, images, size=None):
+        size = normalize_size(size, self.size)
+        blob = self._blob(len(images), size)
+        geometry = []
+        for slot, image in zip(blob, images):
+            padded, scale, pad = self.letterbox_pool.letterbox(image, size)
+            # BGR HWC uint8 to RGB CHW float in [0, 1], straight into the input buffer
+            np.multiply(padded[..., ::-1].transpose(2, 0, 1), 1 / 255.0, out=slot, casting="unsafe")
+            geometry.append((scale, pad))
+        outputs = np.concatenate([self._forward(blob[i:i + self.max_batch]) for i in range(0, len(blob), self.max_batch)])
+        return [
+            postprocess(output, scale, pad, image.shape)
+            for output, image, (scale, pad) in zip(outputs, images, geometry)
+        ]
+
+
+class OnnxDetector(ExportedDetector):
+    """An exported .onnx model run by ONNX Runtime on the CPU."""
+    backend = "onnx"
+
+    def __init__(self, path, threads=INFERENCE_THREADS, size=INFERENCE_SIZE):
+        super().__init__(size)
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.max_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else 64
+        # ultralytics stores the class names in the model metadata
+        self.names = ast.literal_eval(self.session.get_modelmeta().custom_metadata_map["names"])
+
+    def _forward(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVinoDetector(ExportedDetector):
+    """An exported OpenVINO IR model compiled for the CPU."""
+    backend = "openvino"
+
+    def __init__(self, path, threads=INFERENCE_THREADS, size=INFERENCE_SIZE):
+        super().__init__(size)
+        import openvino
+        import yaml
+        core = openvino.Core()
+        model = core.read_model(path)
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = core.compile_model(model, "CPU", config)
+        batch = model.input(0).get_partial_shape()[0]
+        self.max_batch = batch.get_length() if batch.is_static else 64
+        with open(os.path.join(os.path.dirname(path), "metadata.yaml")) as metadata:
+            self.names = yaml.safe_load(metadata)["names"]
+
+    def _forward(self, blob):
+        return self.compiled(blob)[0]
+
+
+def exported_path(weights, backend, int8=False):
+    """Return where the exported model of the weights for a backend lives."""
+    stem = os.path.splitext(weights)[0]
+    if backend == "onnx":
+        return f"{stem}_int8.onnx" if int8 else f"{stem}.onnx"
+    directory = f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+    return os.path.join(directory, os.path.basename(stem) + ".xml")
+
+
+def export_model(weights, backend, int8=False, size=INFERENCE_SIZE):
+    """
+    Export the .pt weights for the backend with ultralytics. INT8 OpenVINO
+    models are calibrated by ultralytics; INT8 ONNX models are dynamically
+    quantized with ONNX Runtime.
+    """
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    if backend == "openvino":
+        model.export(format="openvino", imgsz=size, dynamic=True, int8=int8)
+        return exported_path(weights, backend, int8)
+
+    path = model.export(format="onnx", imgsz=size, dynamic=True)
+    if int8:
+        import onnx
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = exported_path(weights, backend, int8=True)
+        quantize_dynamic(path, int8_path, weight_type=QuantType.QUInt8)
+        # Keep the class names of the original model
+        original, quantized = onnx.load(path), onnx.load(int8_path)
+        quantized.metadata_props.extend(original.metadata_props)
+        onnx.save(quantized, int8_path)
+        return int8_path
+    return path
+
+
+def load_detector(weights, backend=INFERENCE_BACKEND, int8=INFERENCE_INT8, threads=INFERENCE_THREADS, size=INFERENCE_SIZE, warmup=WARMUP_RUNS):
+    """
+    Load the weights for the backend, exporting them first if needed, and warm the model up.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    if backend == "pytorch":
+        detector = TorchDetector(weights, threads, size)
+    else:
+        path = exported_path(weights, backend, int8)
+        if not os.path.exists(path):
+            path = export_model(weights, backend, int8, size)
+        detector_class = OnnxDetector if backend == "onnx" else OpenVinoDetector
+        detector = detector_class(path, threads, size)
+    if warmup:
+        detector.warmup(warmup)
+    return detector
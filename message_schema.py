@@ -0,0 +1,97 @@
+import os
+import pickle
+import struct
+
+import msgpack
+import numpy as np
+
+# Version of the queue message schema, bumped on incompatible changes
+SCHEMA_VERSION = 1
+# Messages start with the magic, the schema version and the header length.
+# The header follows, a msgpack array of the sizes of the out of band buffers
+# and the message, then the buffers themselves.
+MESSAGE_MAGIC = b"VMSG"
+MESSAGE_PREFIX = struct.Struct("<4sBI")
+# Bytes values at least this large travel out of band, after the header
+OUT_OF_BAND_MIN_SIZE = 1024
+# Accept pickled messages from services that were not upgraded yet. Only
+# enable this during a rolling upgrade, unpickling runs arbitrary code.
+ACCEPT_PICKLE_MESSAGES = os.getenv("ACCEPT_PICKLE_MESSAGES", "false").lower() in ("1", "true", "yes")
+
+# msgpack extension types for the references to out of band data
+EXT_BUFFER = 1
+EXT_NDARRAY = 2
+
+
+# Values msgpack packs as they are, skipped without further checks
+_PLAIN_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+def _extract(value, buffers):
+    """Replace large bytes and ndarrays in a message by references to buffers."""
+    value_type = type(value)
+    if value_type in _PLAIN_TYPES:
+        return value
+    if value_type is dict:
+        return {key: item if type(item) in _PLAIN_TYPES else _extract(item, buffers) for key, item in value.items()}
+    if value_type is list or value_type is tuple:
+        return [item if type(item) in _PLAIN_TYPES else _extract(item, buffers) for item in value]
+    if isinstance(value, dict):
+        return {key: _extract(item, buffers) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_extract(item, buffers) for item in value]
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        buffers.append(memoryview(array).cast("B"))
+        return msgpack.ExtType(EXT_NDARRAY, msgpack.packb([len(buffers) - 1, array.dtype.str, list(array.shape)]))
+    if isinstance(value, (bytes, bytearray, memoryview)) and len(value) >= OUT_OF_BAND_MIN_SIZE:
+        buffers.append(memoryview(value).cast("B"))
+        return msgpack.ExtType(EXT_BUFFER, struct.pack("<I", len(buffers) - 1))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def pack_message(message):
+    """
+    Serialize a queue message. Large bytes values, such as encoded images,
+    and ndarrays are appended after the header instead of being copied into it.
+    """
+    buffers = []
+    message = _extract(message, buffers)
+    header = msgpack.packb([[buffer.nbytes for buffer in buffers], message], use_bin_type=True)
+    return b"".join([MESSAGE_PREFIX.pack(MESSAGE_MAGIC, SCHEMA_VERSION, len(header)), header, *buffers])
+
+
+def unpack_message(body):
+    """
+    Deserialize a queue message. Out of band bytes come back as memoryviews
+    and ndarrays as read-only arrays, both over the message body without a copy.
+    """
+    view = memoryview(body)
+    if bytes(view[:len(MESSAGE_MAGIC)]) != MESSAGE_MAGIC:
+        if ACCEPT_PICKLE_MESSAGES:
+            return pickle.loads(body)
+        raise ValueError("Message is not in the queue message schema")
+    magic, version, header_length = MESSAGE_PREFIX.unpack_from(view)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Unsupported message schema version: {version}")
+
+    buffers = []
+
+    def ext_hook(code, data):
+        if code == EXT_BUFFER:
+            return buffers[struct.unpack("<I", data)[0]]
+        if code == EXT_NDARRAY:
+            index, dtype, shape = msgpack.unpackb(data)
+            return np.frombuffer(buffers[index], dtype=np.dtype(dtype)).reshape(shape)
+        return msgpack.ExtType(code, data)
+
+    offset = MESSAGE_PREFIX.size + header_length
+    unpacker = msgpack.Unpacker(raw=False, ext_hook=ext_hook, strict_map_key=False, max_buffer_size=header_length)
+    unpacker.feed(view[MESSAGE_PREFIX.size:offset])
+    unpacker.read_array_header()
+    for size in unpacker.unpack():
+        buffers.append(view[offset:offset + size])
+        offset += size
+    return unpacker.unpack()
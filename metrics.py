@@ -0,0 +1,208 @@
+import bisect
+import contextlib
+import http.server
+import os
+import threading
+import time
+
+# Latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labels, extra=""):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """A counter per combination of label values."""
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames, lock):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = lock
+        self.values = {}  # label values -> count
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _merge(self, key, value):
+        self.values[key] = self.values.get(key, 0) + value
+
+    def _render(self):
+        return [f"{self.name}_total{_format_labels(self.labelnames, key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(Counter):
+    """A latency histogram per combination of label values."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames, lock, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames, lock)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            state[bisect.bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _merge(self, key, value):
+        state = self.values.get(key)
+        if state is None:
+            self.values[key] = list(value)
+        else:
+            for i, amount in enumerate(value):
+                state[i] += amount
+
+    def _render(self):
+        lines = []
+        for key, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of one service, rendered in the Prometheus text format.
+
+    Worker processes send their metrics to the process that serves them with
+    take_delta(), which returns and clears what they recorded, and merge().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        # A thread of the parent may hold the lock while it forks, and the
+        # child's copy would stay locked for good
+        os.register_at_fork(after_in_child=self._new_lock)
+
+    def _new_lock(self):
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.lock = self.lock
+
+    def _get(self, metric_class, name, help, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, help, labelnames, self.lock, **kwargs)
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def reset(self):
+        """Clear every value, e.g. in a forked worker that inherited its parent's."""
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values = {}
+
+    def take_delta(self):
+        """Return the values recorded since the last call and clear them."""
+        with self.lock:
+            delta = {name: metric.values for name, metric in self.metrics.items() if metric.values}
+            for name in delta:
+                self.metrics[name].values = {}
+        return delta
+
+    def merge(self, delta):
+        """Add the values of a take_delta() from another process."""
+        with self.lock:
+            for name, values in delta.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in values.items():
+                    metric._merge(tuple(key), value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric._render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+
+# Metrics shared by the services of the pipeline
+STAGE_SECONDS = histogram("vms_stage_seconds", "Latency of each pipeline stage", ("stage",))
+CAMERA_FRAMES = counter("vms_camera_frames", "Frames of each camera by pipeline step", ("camera", "step"))
+END_TO_END_SECONDS = histogram("vms_end_to_end_seconds", "Time from frame capture to the event reaching the writer", ("camera",))
+
+
+def capture_age(message, key="capture_time"):
+    """Return the seconds since the message's capture timestamp, or None without one."""
+    capture_time = message.get(key)
+    return None if capture_time is None else max(0.0, time.time() - capture_time)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line
+
+
+def start_metrics_server(default_port):
+    """
+    Serve /metrics on METRICS_PORT, or default_port without it, from a
+    background thread. A port of 0 disables the endpoint.
+    """
+    port = int(os.getenv("METRICS_PORT", str(default_port)))
+    if port <= 0:
+        return None
+    server = http.server.ThreadingHTTPServer(("", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,99 @@
+import gc
+import os
+import threading
+import time
+
+from inference_backend import INFERENCE_THREADS, WARMUP_RUNS, load_detector
+
+# Models unused for MODEL_IDLE_TTL seconds are unloaded, 0 keeps them loaded
+MODEL_IDLE_TTL = float(os.getenv("MODEL_IDLE_TTL", "900"))
+# How often the registry looks for idle models, in seconds
+MODEL_IDLE_CHECK_INTERVAL = 60
+
+
+class ModelRegistry:
+    """
+    Load models the first time they are needed and unload the ones that stay idle.
+
+    weights maps a model name to its weights file. Models are loaded with
+    load_detector() on the configured inference backend, so memory and
+    startup time follow the rules that are actually in use. warmup is the
+    number of warm-up runs of a newly loaded model, 0 leaves it cold.
+    """
+
+    def __init__(self, weights, idle_ttl=MODEL_IDLE_TTL, threads=INFERENCE_THREADS, logger=None, warmup=WARMUP_RUNS):
+        self.weights = dict(weights)
+        self.idle_ttl = idle_ttl
+        self.threads = threads
+        self.warmup = warmup
+        self.logger = logger
+        self.models = {}  # name -> detector
+        self.last_used = {}
+        self.load_seconds = {}
+        self.last_idle_check = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def get(self, name):
+        """Return the named model, loading it if it is not resident."""
+        now = time.monotonic()
+        if now - self.last_idle_check > MODEL_IDLE_CHECK_INTERVAL:
+            self.unload_idle(now)
+        with self.lock:
+            detector = self.models.get(name)
+            if detector is None:
+                start = time.perf_counter()
+                detector = load_detector(self.weights[name], threads=self.threads, warmup=self.warmup)
+                self.load_seconds[name] = time.perf_counter() - start
+                self.models[name] = detector
+                self.last_used[name] = now
+                self._log(f"Loaded model {name} in {self.load_seconds[name]:.1f}s, resident models: {self.resident()}")
+            self.last_used[name] = now
+            return detector
+
+    def preload(self, names=None):
+        """Load the named models, or every configured model, ahead of their first frame."""
+        for name in self.weights if names is None else names:
+            self.get(name)
+
+    def warm_up(self):
+        """Warm up the resident models, e.g. ones loaded cold before a fork."""
+        with self.lock:
+            detectors = list(self.models.values())
+        for detector in detectors:
+            detector.warmup(self.warmup)
+
+    def unload_idle(self, now=None):
+        """Unload the models idle for longer than the TTL and return their names."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.last_idle_check = now
+            if self.idle_ttl <= 0:
+                return []
+            idle = [name for name in self.models if now - self.last_used[name] > self.idle_ttl]
+            for name in idle:
+                del self.models[name]
+            if idle:
+                gc.collect()
+                self._log(f"Unloaded idle models {idle}, resident models: {self.resident()}")
+            return idle
+
+    def clear(self):
+        """Drop every loaded model, e.g. in a forked process that cannot use them."""
+        with self.lock:
+            self.models.clear()
+
+    def resident(self):
+        """Return the loaded models with their backend, load time and idle seconds."""
+        now = time.monotonic()
+        return {
+            name: {
+                "backend": detector.backend,
+                "load_seconds": round(self.load_seconds[name], 2),
+                "idle_seconds": round(now - self.last_used.get(name, now), 1),
+            }
+            for name, detector in self.models.items()
+        }
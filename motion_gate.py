@@ -0,0 +1,74 @@
+import time
+
+import cv2
+
+# Default motion gate settings, overridden per camera through the camera details
+DEFAULT_MOTION_PIXEL_DELTA = 25
+DEFAULT_MOTION_KEEPALIVE = 60
+MOTION_WIDTH = 160
+
+
+class MotionGate:
+    """
+    Decide whether a frame changed enough since the last ones to be worth analysing.
+
+    Frames are downscaled to grayscale and compared against a running average
+    background. The motion score is the fraction of pixels that differ from the
+    background by more than pixel_delta. Frames below threshold are skipped, but
+    one frame is still let through every keepalive seconds so that static
+    scenes are analysed now and then.
+    """
+
+    def __init__(self, threshold, pixel_delta=DEFAULT_MOTION_PIXEL_DELTA, keepalive=DEFAULT_MOTION_KEEPALIVE, learning_rate=0.05):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.keepalive = keepalive
+        self.learning_rate = learning_rate
+        self.background = None
+        self.last_passed = 0.0
+        self.checked = 0
+        self.skipped = 0
+
+    def _prepare(self, frame):
+        height, width = frame.shape[:2]
+        size = (MOTION_WIDTH, max(1, height * MOTION_WIDTH // width))
+        gray = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0).astype("float32")
+
+    def score(self, frame):
+        """Return the fraction of changed pixels and update the background."""
+        gray = self._prepare(frame)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            return 1.0
+        changed = cv2.absdiff(gray, self.background) > self.pixel_delta
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+        return float(changed.mean())
+
+    def check(self, frame):
+        """Return True if the frame should be sent on for inference."""
+        self.checked += 1
+        now = time.monotonic()
+        if self.score(frame) >= self.threshold or now - self.last_passed >= self.keepalive:
+            self.last_passed = now
+            return True
+        self.skipped += 1
+        return False
+
+    def stats(self):
+        return {"checked": self.checked, "skipped": self.skipped}
+
+
+def create_motion_gate(options=None):
+    """
+    Build the motion gate from the per camera options, or None if it is disabled.
+    """
+    options = options or {}
+    threshold = float(options.get("MotionThreshold") or 0)
+    if threshold <= 0:
+        return None
+    return MotionGate(
+        threshold,
+        pixel_delta=int(options.get("MotionPixelDelta") or DEFAULT_MOTION_PIXEL_DELTA),
+        keepalive=float(options.get("MotionKeepalive") or DEFAULT_MOTION_KEEPALIVE),
+    )
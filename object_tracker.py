@@ -0,0 +1,105 @@
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+# Tracking settings. A track survives TRACK_MAX_AGE seconds without a match,
+# longer than the motion gate keepalive so that static objects keep their track.
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+TRACK_MAX_AGE = float(os.getenv("TRACK_MAX_AGE", "120"))
+TRACK_MAX_CAMERAS = int(os.getenv("TRACK_MAX_CAMERAS", "10000"))
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Return the pairwise intersection over union of two (N, 4+) and (M, 4+) box arrays.
+    """
+    a = boxes_a[:, None, :4]
+    b = boxes_b[None, :, :4]
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-9)
+
+
+class IoUTracker:
+    """
+    Give detections stable track IDs by greedy IoU association with the last
+    box of every live track. Boxes only match tracks of the same class.
+
+    Detections are (N, 6) arrays of [x1, y1, x2, y2, score, class_id]. Tracks
+    that were not matched for max_age seconds are dropped.
+    """
+
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_age=TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.boxes = np.empty((0, 6), dtype=np.float32)
+        self.track_ids = np.empty(0, dtype=np.int64)
+        self.last_seen = np.empty(0, dtype=np.float64)
+        self.next_id = 1
+
+    def update(self, boxes, now=None):
+        """
+        Associate the boxes with the tracks.
+
+        Returns (track_ids, new) where new marks the boxes that started a track.
+        """
+        now = time.monotonic() if now is None else now
+        alive = now - self.last_seen < self.max_age
+        self.boxes, self.track_ids, self.last_seen = self.boxes[alive], self.track_ids[alive], self.last_seen[alive]
+
+        track_ids = np.zeros(len(boxes), dtype=np.int64)
+        matched_tracks = np.zeros(len(self.boxes), dtype=bool)
+        if len(boxes) and len(self.boxes):
+            overlap = iou_matrix(boxes, self.boxes)
+            overlap[boxes[:, 5][:, None] != self.boxes[:, 5][None, :]] = 0
+            # Greedy matching, best overlaps first
+            for flat in np.argsort(overlap, axis=None)[::-1]:
+                box, track = divmod(int(flat), overlap.shape[1])
+                if overlap[box, track] < self.iou_threshold:
+                    break
+                if track_ids[box] or matched_tracks[track]:
+                    continue
+                track_ids[box] = self.track_ids[track]
+                matched_tracks[track] = True
+
+        new = track_ids == 0
+        track_ids[new] = np.arange(self.next_id, self.next_id + int(new.sum()))
+        self.next_id += int(new.sum())
+
+        # Matched tracks move to their new box, unmatched ones keep their last box until they expire
+        keep = ~matched_tracks
+        self.boxes = np.concatenate([self.boxes[keep], boxes[:, :6].astype(np.float32)])
+        self.track_ids = np.concatenate([self.track_ids[keep], track_ids])
+        self.last_seen = np.concatenate([self.last_seen[keep], np.full(len(boxes), now)])
+        return track_ids, new
+
+
+class TrackerRegistry:
+    """
+    One tracker per camera and rule, for the most recently seen max_cameras cameras.
+    """
+
+    def __init__(self, max_cameras=TRACK_MAX_CAMERAS):
+        self.max_cameras = max_cameras
+        self.cameras = collections.OrderedDict()  # camera_id -> {rule: IoUTracker}
+        self.lock = threading.Lock()
+
+    def get(self, camera_id, rule):
+        with self.lock:
+            trackers = self.cameras.get(camera_id)
+            if trackers is None:
+                trackers = self.cameras[camera_id] = {}
+                if len(self.cameras) > self.max_cameras:
+                    self.cameras.popitem(last=False)
+            else:
+                self.cameras.move_to_end(camera_id)
+            tracker = trackers.get(rule)
+            if tracker is None:
+                tracker = trackers[rule] = IoUTracker()
+            return tracker
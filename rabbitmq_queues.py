@@ -0,0 +1,22 @@
+import os
+
+# Limits for the frames queue. Every service that declares a queue must use
+# the same arguments, otherwise RabbitMQ refuses the declaration.
+FRAMES_QUEUE_MAX_LENGTH = int(os.getenv("FRAMES_QUEUE_MAX_LENGTH", "1000"))
+# "reject-publish" nacks new frames so senders drop their oldest ones,
+# "drop-head" makes the broker drop the oldest frames in the queue instead.
+FRAMES_QUEUE_OVERFLOW = os.getenv("FRAMES_QUEUE_OVERFLOW", "reject-publish")
+
+QUEUE_ARGUMENTS = {
+    "all_frames": {
+        "x-max-length": FRAMES_QUEUE_MAX_LENGTH,
+        "x-overflow": FRAMES_QUEUE_OVERFLOW,
+    },
+}
+
+
+def queue_arguments(queue_name):
+    """
+    Return the declare arguments of a queue, or None for a plain queue.
+    """
+    return QUEUE_ARGUMENTS.get(queue_name)
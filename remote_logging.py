@@ -0,0 +1,137 @@
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+import pika
+
+from message_schema import pack_message
+
+# Log shipping settings
+LOG_QUEUE_NAME = "anpr_logs"
+LOG_RABBITMQ_HOST = os.getenv("LOG_RABBITMQ_HOST", "rabbitmq")
+LOG_MAX_PENDING = int(os.getenv("LOG_MAX_PENDING", "10000"))
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_INTERVAL = 1.0
+LOG_RETRY_DELAY = 5
+
+
+class LogShipper:
+    """
+    Ship log messages to RabbitMQ from a background thread.
+
+    Messages are queued in memory and published in batches over one
+    long-lived connection. When the queue is full new messages are dropped,
+    so logging never blocks the caller.
+    """
+
+    def __init__(self, rabbitmq_host=LOG_RABBITMQ_HOST, queue_name=LOG_QUEUE_NAME, max_pending=LOG_MAX_PENDING):
+        self.rabbitmq_host = rabbitmq_host
+        self.queue_name = queue_name
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def ship(self, log_message):
+        try:
+            self.pending.put_nowait(log_message)
+        except queue.Full:
+            self.dropped += 1
+
+    def _next_batch(self):
+        try:
+            batch = [self.pending.get(timeout=LOG_FLUSH_INTERVAL)]
+        except queue.Empty:
+            return []
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        connection = channel = None
+        while True:
+            batch = self._next_batch()
+            try:
+                if channel is None or not channel.is_open:
+                    connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.rabbitmq_host, heartbeat=600))
+                    channel = connection.channel()
+                    channel.queue_declare(queue=self.queue_name)  # Declare the queue for logs
+                if self.dropped:
+                    dropped, self.dropped = self.dropped, 0
+                    batch.append(make_log_message("ERROR", "Log shipping", f"Dropped {dropped} log messages, log queue was full"))
+                for log_message in batch:
+                    channel.basic_publish(exchange='', routing_key=self.queue_name, body=pack_message(log_message))
+                # Keep the connection's heartbeats going while idle
+                connection.process_data_events(time_limit=0)
+            except Exception as e:
+                print(f"Failed to send {len(batch)} logs to RabbitMQ: {e}")
+                self.dropped += len(batch)
+                connection = channel = None
+                time.sleep(LOG_RETRY_DELAY)
+
+
+_shipper = None
+_shipper_pid = None
+_shipper_lock = threading.Lock()
+
+
+def get_log_shipper():
+    """
+    Return the log shipper of this process. A forked process gets its own,
+    since the parent's shipper thread does not survive the fork.
+    """
+    global _shipper, _shipper_pid
+    if _shipper_pid != os.getpid():
+        with _shipper_lock:
+            if _shipper_pid != os.getpid():
+                _shipper = LogShipper()
+                _shipper_pid = os.getpid()
+    return _shipper
+
+
+def make_log_message(log_level, event_type, message):
+    return {
+        "log_level": log_level,
+        "Event_Type": event_type,
+        "Message": message,
+        "datetime": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def send_log_to_rabbitmq(log_message):
+    get_log_shipper().ship(log_message)
+
+
+class RabbitMQLogHandler(logging.Handler):
+    """
+    Logging handler that ships records to the logs queue without blocking.
+    The remote log level can be overridden with extra={"log_level": ...}.
+    """
+
+    def __init__(self, event_type):
+        super().__init__()
+        self.event_type = event_type
+
+    def emit(self, record):
+        try:
+            log_level = getattr(record, "log_level", record.levelname)
+            send_log_to_rabbitmq(make_log_message(log_level, self.event_type, record.getMessage()))
+        except Exception:
+            self.handleError(record)
+
+
+def get_remote_logger(name, event_type):
+    """
+    Return a logger whose records are also shipped to RabbitMQ with the given Event_Type.
+    """
+    logger = logging.getLogger(name)
+    if not any(isinstance(handler, RabbitMQLogHandler) for handler in logger.handlers):
+        logger.addHandler(RabbitMQLogHandler(event_type))
+    logger.setLevel(logging.INFO)
+    return logger
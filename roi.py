@@ -0,0 +1,99 @@
+import functools
+
+import cv2
+import numpy as np
+
+
+def _to_pixels(polygon, width, height):
+    """
+    Convert a polygon of [x, y] points to integer pixel coordinates. Points
+    given as fractions of the frame size (all values <= 1) are scaled.
+    """
+    points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    if points.size and points.max() <= 1:
+        points = points * (width, height)
+    return np.round(points).astype(np.int32)
+
+
+class RegionOfInterest:
+    """
+    A camera's region of interest from its Roi and RoiExclusions options.
+
+    Roi is one polygon the camera's detections must lie in, RoiExclusions a
+    list of polygons they must not lie in. Frames are cropped to the bounding
+    box of the ROI before they are sent, and the polygons are sent along in
+    the crop's coordinates.
+    """
+
+    def __init__(self, polygon=None, exclusions=None):
+        self.polygon = polygon
+        self.exclusions = exclusions or []
+
+    def crop(self, frame):
+        """
+        Return the frame cropped to the ROI and its metadata for the analytics stage.
+        """
+        height, width = frame.shape[:2]
+        offset = np.zeros(2, dtype=np.int32)
+        if self.polygon:
+            polygon = _to_pixels(self.polygon, width, height)
+            x1, y1 = np.clip(polygon.min(axis=0), 0, (width, height))
+            x2, y2 = np.clip(polygon.max(axis=0), 0, (width, height))
+            if x2 - x1 > 1 and y2 - y1 > 1:
+                frame = frame[y1:y2, x1:x2]
+                offset = np.array((x1, y1), dtype=np.int32)
+        metadata = {
+            "offset": offset.tolist(),
+            "polygon": (_to_pixels(self.polygon, width, height) - offset).tolist() if self.polygon else None,
+            "exclusions": [(_to_pixels(exclusion, width, height) - offset).tolist() for exclusion in self.exclusions],
+        }
+        return frame, metadata
+
+
+def create_roi(options=None):
+    """
+    Build the region of interest from the per camera options, or None if the camera has none.
+    """
+    options = options or {}
+    polygon = options.get("Roi") or None
+    exclusions = options.get("RoiExclusions") or []
+    if not polygon and not exclusions:
+        return None
+    return RegionOfInterest(polygon, exclusions)
+
+
+@functools.lru_cache(maxsize=256)
+def _roi_mask(shape, polygon, exclusions):
+    mask = np.zeros(shape, dtype=np.uint8)
+    if polygon:
+        cv2.fillPoly(mask, [np.array(polygon, dtype=np.int32)], 1)
+    else:
+        mask[:] = 1
+    for exclusion in exclusions:
+        cv2.fillPoly(mask, [np.array(exclusion, dtype=np.int32)], 0)
+    return mask.astype(bool)
+
+
+def _freeze(polygon):
+    return tuple(tuple(point) for point in polygon) if polygon else None
+
+
+def roi_mask(shape, roi):
+    """
+    Return a boolean (height, width) mask of the pixels inside the ROI
+    metadata's polygon and outside its exclusions. Masks are cached.
+    """
+    return _roi_mask(shape, _freeze(roi.get("polygon")), tuple(_freeze(exclusion) for exclusion in roi.get("exclusions") or []))
+
+
+def filter_boxes_by_roi(boxes, roi, shape):
+    """
+    Select the rows of an (N, 6) box array whose center lies in the region of interest.
+    """
+    if not roi or len(boxes) == 0:
+        return boxes
+    height, width = shape[:2]
+    mask = roi_mask((height, width), roi)
+    centers_x = np.clip(((boxes[:, 0] + boxes[:, 2]) // 2).astype(np.int64), 0, width - 1)
+    centers_y = np.clip(((boxes[:, 1] + boxes[:, 3]) // 2).astype(np.int64), 0, height - 1)
+    return boxes[mask[centers_y, centers_x]]
@@ -0,0 +1,193 @@
+import collections
+import os
+import re
+import signal
+import struct
+import threading
+import time
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# "shm" keeps frames in shared memory and only sends descriptors over the
+# frames queue. It needs the sender and analytics on the same host.
+FRAME_TRANSPORT = os.getenv("FRAME_TRANSPORT", "rabbitmq")
+# Frames kept per camera before the oldest slot is overwritten
+SHM_SLOTS = int(os.getenv("SHM_SLOTS", "8"))
+# Segments a reader keeps attached, the least recently read ones are closed first
+SHM_MAX_ATTACHED = 256
+
+# Slot header: sequence number, 0 while the slot is written
+SLOT_HEADER = struct.Struct("<Q")
+SLOT_ALIGN = 64
+
+
+# Rings with a segment in this process, unlinked when the process is terminated
+_live_rings = weakref.WeakSet()
+
+
+def _align(size):
+    return (size + SLOT_ALIGN - 1) // SLOT_ALIGN * SLOT_ALIGN
+
+
+def is_shm_descriptor(value):
+    return isinstance(value, dict) and value.get("transport") == "shm"
+
+
+class FrameRing:
+    """
+    Ring buffer of one camera's frames in a shared memory segment.
+
+    write() copies a frame into the next slot and returns a small descriptor
+    to send instead of the frame. Each slot starts with the sequence number
+    of its frame, so a reader can tell when a frame was overwritten. The
+    segment is recreated under a new name when a larger frame arrives.
+    A segment left behind under the same name, by a killed sender whose pid
+    was reused, is removed first.
+    """
+
+    def __init__(self, camera_id, slots=SHM_SLOTS):
+        self.prefix = f"vms_{re.sub(r'[^A-Za-z0-9_]', '_', str(camera_id))}_{os.getpid()}"
+        self.slots = max(2, slots)
+        self.shm = None
+        self.slot_size = 0
+        self.capacity = 0
+        self.generation = 0
+        self.sequence = 0
+        _live_rings.add(self)
+
+    def _allocate(self, nbytes):
+        self.close()
+        self.generation += 1
+        self.capacity = nbytes
+        self.slot_size = _align(SLOT_HEADER.size) + _align(nbytes)
+        name = f"{self.prefix}_{self.generation}"
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.slot_size * self.slots)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.slot_size * self.slots)
+
+    def write(self, frame, **metadata):
+        """Copy the frame into the ring and return its descriptor."""
+        frame = np.ascontiguousarray(frame)
+        if self.shm is None or frame.nbytes > self.capacity:
+            self._allocate(frame.nbytes)
+        self.sequence += 1
+        slot = self.sequence % self.slots
+        offset = slot * self.slot_size
+        # Mark the slot as being written, so readers of its previous frame see it is gone
+        SLOT_HEADER.pack_into(self.shm.buf, offset, 0)
+        data = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.shm.buf, offset=offset + _align(SLOT_HEADER.size))
+        data[...] = frame
+        del data
+        SLOT_HEADER.pack_into(self.shm.buf, offset, self.sequence)
+        return {
+            "transport": "shm",
+            "shm": self.shm.name,
+            "slot": slot,
+            "offset": offset,
+            "sequence": self.sequence,
+            "shape": list(frame.shape),
+            "dtype": str(frame.dtype),
+            "timestamp": time.time(),
+            **metadata,
+        }
+
+    def unlink(self):
+        """Remove the segment's name. Its memory is freed once every mapping is closed."""
+        if self.shm is not None:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Release and remove the segment. Readers keep their mappings until they close them."""
+        if self.shm is not None:
+            self.shm.close()
+            self.unlink()
+            self.shm = None
+
+
+def unlink_rings_on_terminate():
+    """
+    Make SIGTERM unlink the segments of this process's rings and then exit,
+    so a terminated sender does not leave them behind in /dev/shm.
+    """
+    def terminate(signum, frame):
+        for ring in list(_live_rings):
+            ring.unlink()
+        raise SystemExit(128 + signum)
+    signal.signal(signal.SIGTERM, terminate)
+
+
+class FrameRingReader:
+    """
+    Read frames in place from the rings of the senders on this host.
+    """
+
+    def __init__(self, max_attached=SHM_MAX_ATTACHED):
+        self.max_attached = max_attached
+        self.segments = collections.OrderedDict()  # name -> SharedMemory
+
+    def _segment(self, name):
+        shm = self.segments.get(name)
+        if shm is not None:
+            self.segments.move_to_end(name)
+            return shm
+        shm = shared_memory.SharedMemory(name=name)
+        # The sender owns the segment; without this the resource tracker
+        # would unlink it when this process exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+        self.segments[name] = shm
+        while len(self.segments) > self.max_attached:
+            oldest_name, oldest = self.segments.popitem(last=False)
+            try:
+                oldest.close()
+            except BufferError:
+                # Frames of it are still in use, keep it attached a while longer
+                self.segments[oldest_name] = oldest
+                break
+        return shm
+
+    def is_current(self, descriptor):
+        """Return True if the descriptor's frame was not overwritten."""
+        try:
+            shm = self._segment(descriptor["shm"])
+        except FileNotFoundError:
+            return False
+        return SLOT_HEADER.unpack_from(shm.buf, descriptor["offset"])[0] == descriptor["sequence"]
+
+    def read(self, descriptor):
+        """
+        Return a read-only view of the descriptor's frame, or None if the
+        frame was overwritten or its sender is gone.
+        """
+        if not self.is_current(descriptor):
+            return None
+        shm = self._segment(descriptor["shm"])
+        frame = np.ndarray(descriptor["shape"], dtype=descriptor["dtype"], buffer=shm.buf, offset=descriptor["offset"] + _align(SLOT_HEADER.size))
+        frame.flags.writeable = False
+        return frame
+
+
+_reader = None
+_reader_pid = None
+_reader_lock = threading.Lock()
+
+
+def get_frame_reader():
+    """
+    Return the frame reader of this process. A forked process gets its own.
+    """
+    global _reader, _reader_pid
+    if _reader_pid != os.getpid():
+        with _reader_lock:
+            if _reader_pid != os.getpid():
+                _reader = FrameRingReader()
+                _reader_pid = os.getpid()
+    return _reader
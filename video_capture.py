@@ -0,0 +1,417 @@
+import os
+import threading
+import time
+
+import cv2
+
+try:
+    import av
+except ImportError:  # Only needed for the keyframe decode modes
+    av = None
+PYAV_AVAILABLE = av is not None
+
+# Used when a stream does not report a usable FPS
+DEFAULT_STREAM_FPS = 25.0
+# How often the sampler re-measures the stream's real frame rate, in seconds
+FPS_MEASURE_INTERVAL = 10.0
+# Sleep between failed grabs, doubled on every failure up to the maximum
+MIN_BACKOFF = 0.01
+MAX_BACKOFF = 0.5
+
+# FFmpeg capture defaults, overridden per camera through the camera details
+RTSP_TRANSPORT = os.getenv("RTSP_TRANSPORT", "tcp")
+CAPTURE_OPEN_TIMEOUT_MS = 10000
+CAPTURE_READ_TIMEOUT_MS = 10000
+# Camera options that control how a stream is opened, also used for snapshots
+CAPTURE_OPTION_KEYS = ("RtspTransport", "LowLatency", "BufferSize", "DecodeThreads")
+# Frames read after opening a stream for a snapshot before giving up
+SNAPSHOT_READ_ATTEMPTS = 50
+# "all" decodes every frame with OpenCV, "keyframes" only decodes keyframes
+# and "auto" only decodes keyframes when they are frequent enough, both with PyAV
+DECODE_MODES = ("all", "keyframes", "auto")
+# Auto mode uses keyframes when they come at least this fraction of the sample rate
+KEYFRAME_RATE_TOLERANCE = 0.9
+# OpenCV reads the FFmpeg options from this variable when it opens a capture
+FFMPEG_OPTIONS_ENV = "OPENCV_FFMPEG_CAPTURE_OPTIONS"
+
+_open_condition = threading.Condition()
+_open_options = None
+_opening = 0
+
+
+def ffmpeg_options(options=None):
+    """
+    Return the FFmpeg demuxer options for a camera's capture options:
+    RtspTransport ("tcp" or "udp"), LowLatency, which turns off FFmpeg's
+    input buffering and packet reordering, and BufferSize, the socket
+    receive buffer in bytes.
+    """
+    options = options or {}
+    ffmpeg = {"rtsp_transport": str(options.get("RtspTransport") or RTSP_TRANSPORT).lower()}
+    if options.get("LowLatency"):
+        ffmpeg.update({"fflags": "nobuffer", "max_delay": "0", "reorder_queue_size": "0"})
+    if options.get("BufferSize"):
+        ffmpeg["buffer_size"] = str(int(options["BufferSize"]))
+    return ffmpeg
+
+
+def open_capture(url, options=None):
+    """
+    Open a cv2.VideoCapture on the FFmpeg backend with the camera's capture
+    options. DecodeThreads sets the decoder threads, 0 leaves it to FFmpeg.
+    """
+    global _open_options, _opening
+    options = options or {}
+    params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, CAPTURE_OPEN_TIMEOUT_MS, cv2.CAP_PROP_READ_TIMEOUT_MSEC, CAPTURE_READ_TIMEOUT_MS]
+    threads = int(options.get("DecodeThreads") or 0)
+    if threads:
+        params += [cv2.CAP_PROP_N_THREADS, threads]
+    ffmpeg = "|".join(f"{key};{value}" for key, value in ffmpeg_options(options).items())
+    # The FFmpeg options are process wide, so captures with the same options
+    # open together and ones with other options wait their turn
+    with _open_condition:
+        _open_condition.wait_for(lambda: _opening == 0 or _open_options == ffmpeg)
+        if _opening == 0:
+            os.environ[FFMPEG_OPTIONS_ENV] = ffmpeg
+            _open_options = ffmpeg
+        _opening += 1
+    try:
+        return cv2.VideoCapture(url, cv2.CAP_FFMPEG, params)
+    finally:
+        with _open_condition:
+            _opening -= 1
+            _open_condition.notify_all()
+
+
+def capture_options(options):
+    """Return the camera options that control how its streams are opened."""
+    return {key: options[key] for key in CAPTURE_OPTION_KEYS if key in (options or {})}
+
+
+def grab_frame(url, options=None, attempts=SNAPSHOT_READ_ATTEMPTS):
+    """
+    Open a stream, read one frame and close it again. Returns the frame, or
+    None if the stream could not be opened or read.
+    """
+    cap = open_capture(url, options)
+    try:
+        if not cap.isOpened():
+            return None
+        for _ in range(attempts):
+            ret, frame = cap.read()
+            if ret:
+                return frame
+        return None
+    finally:
+        cap.release()
+
+
+def _replay_wait(start, stream_seconds):
+    """Sleep until stream_seconds after start, to read a file at its frame rate."""
+    delay = start + stream_seconds - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+class FrameSampler:
+    """
+    Sample frames from a cv2.VideoCapture at a target FPS.
+
+    Every frame is grabbed so the stream stays current, but only the kept
+    frames are decoded with retrieve(). The keep interval follows the
+    stream's measured frame rate, so a camera that delivers fewer frames
+    than it advertises is still sampled at the target FPS. With realtime
+    set, a video file is read at its frame rate, as a camera delivers it.
+    """
+
+    def __init__(self, cap, frame_interval=25, target_fps=None, realtime=False):
+        self.cap = cap
+        self.frame_interval = max(1, int(frame_interval))
+        self.target_fps = target_fps
+        self.realtime = realtime
+        self.replay_start = time.monotonic()
+        self.stream_fps = self._reported_fps()
+        self.replay_fps = self.stream_fps
+        self.interval = self._interval()
+        self.grabbed = 0
+        self.measure_start = time.monotonic()
+        self.measure_grabbed = 0
+        self.backoff = MIN_BACKOFF
+        self.decode_seconds = 0.0  # Time spent in retrieve() for the last kept frame
+        self.last_grab = time.monotonic()  # When the stream last delivered a frame, kept or not
+
+    def _reported_fps(self):
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        return fps if 0 < fps <= 240 else DEFAULT_STREAM_FPS
+
+    def _interval(self):
+        if not self.target_fps:
+            return self.frame_interval
+        return max(1, round(self.stream_fps / self.target_fps))
+
+    def _measure(self):
+        elapsed = time.monotonic() - self.measure_start
+        if elapsed < FPS_MEASURE_INTERVAL:
+            return
+        if self.measure_grabbed:
+            self.stream_fps = self.measure_grabbed / elapsed
+            self.interval = self._interval()
+        self.measure_start = time.monotonic()
+        self.measure_grabbed = 0
+
+    def read(self):
+        """
+        Return (True, frame) for the next kept frame, or (False, None) after a failed grab.
+        A failed grab sleeps with exponential backoff instead of spinning.
+        """
+        while True:
+            if not self.cap.grab():
+                time.sleep(self.backoff)
+                self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+                return False, None
+            self.backoff = MIN_BACKOFF
+            self.last_grab = time.monotonic()
+            self.grabbed += 1
+            if self.realtime:
+                _replay_wait(self.replay_start, self.grabbed / self.replay_fps)
+            self.measure_grabbed += 1
+            if self.target_fps:
+                self._measure()
+            if self.grabbed % self.interval:
+                continue
+            start = time.perf_counter()
+            ret, frame = self.cap.retrieve()
+            self.decode_seconds = time.perf_counter() - start
+            if ret:
+                return True, frame
+
+
+def get_decode_mode(options):
+    """Return the camera's DecodeMode, "all" without one."""
+    mode = str((options or {}).get("DecodeMode") or "all").lower()
+    if mode not in DECODE_MODES:
+        raise ValueError(f"Unknown DecodeMode {mode!r}, expected one of {', '.join(DECODE_MODES)}")
+    return mode
+
+
+class AvCapture:
+    """
+    A stream opened with PyAV for KeyframeSampler, with the isOpened() and
+    release() of a cv2.VideoCapture. Takes the same capture options as
+    open_capture().
+    """
+
+    def __init__(self, url, options=None):
+        options = options or {}
+        self.container = None
+        self.stream = None
+        try:
+            self.container = av.open(url, options=ffmpeg_options(options), timeout=(CAPTURE_OPEN_TIMEOUT_MS / 1000.0, CAPTURE_READ_TIMEOUT_MS / 1000.0))
+            self.stream = self.container.streams.video[0]
+        except (av.error.FFmpegError, IndexError):
+            self.release()
+            return
+        threads = int(options.get("DecodeThreads") or 0)
+        if threads:
+            self.stream.codec_context.thread_count = threads
+
+    def isOpened(self):
+        return self.container is not None
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+
+class KeyframeSampler:
+    """
+    Sample frames from an AvCapture, decoding only what the sample rate needs.
+
+    In keyframe mode only the keyframes that are due reach the decoder, so a
+    camera sampled every few seconds costs one decode per sample instead of
+    one per frame. Auto mode measures the stream's keyframe rate and only
+    does this while keyframes come about as often as the sample rate;
+    otherwise the decoder skips the non-reference frames, which no other
+    frame needs, and frames are kept by timestamp. With realtime set, a
+    video file is read at its frame rate, as a camera delivers it.
+    """
+
+    def __init__(self, cap, frame_interval=25, target_fps=None, auto=False, realtime=False):
+        self.cap = cap
+        self.realtime = realtime
+        self.replay_start = None  # (wall clock, stream time) of the first packet
+        self.stream = cap.stream
+        stream_fps = float(self.stream.average_rate or 0)
+        stream_fps = stream_fps if 0 < stream_fps <= 240 else DEFAULT_STREAM_FPS
+        # Seconds of stream time between kept frames
+        self.sample_interval = 1.0 / target_fps if target_fps else max(1, int(frame_interval)) / stream_fps
+        self.auto = auto
+        self.keyframes_only = not auto
+        # Set when leaving keyframe mode: the packets up to the next keyframe
+        # refer to frames that were never decoded
+        self.wait_for_keyframe = False
+        self.packets = cap.container.demux(self.stream)
+        self.last_kept = None
+        self.measure_start = None
+        self.measure_keyframes = 0
+        self.keyframe_rate = None  # Keyframes per second, measured in auto mode
+        self.backoff = MIN_BACKOFF
+        self.decode_seconds = 0.0  # Time spent decoding the packet of the last kept frame
+        self.last_grab = time.monotonic()  # When the stream last delivered a packet, kept or not
+        self._set_skip_frame()
+
+    def _set_skip_frame(self):
+        self.stream.codec_context.skip_frame = "NONKEY" if self.keyframes_only else "NONREF"
+
+    def _packet_time(self, packet):
+        if packet.pts is None:
+            return time.monotonic()
+        return float(packet.pts * self.stream.time_base)
+
+    def _measure(self, packet, packet_time):
+        if self.measure_start is None or packet_time < self.measure_start:
+            self.measure_start = packet_time
+            self.measure_keyframes = 0
+        self.measure_keyframes += packet.is_keyframe
+        elapsed = packet_time - self.measure_start
+        if elapsed < FPS_MEASURE_INTERVAL:
+            return
+        self.keyframe_rate = self.measure_keyframes / elapsed
+        keyframes_only = self.keyframe_rate * self.sample_interval >= KEYFRAME_RATE_TOLERANCE
+        if keyframes_only != self.keyframes_only:
+            self.keyframes_only = keyframes_only
+            self.wait_for_keyframe = not keyframes_only
+            self._set_skip_frame()
+        self.measure_start = packet_time
+        self.measure_keyframes = 0
+
+    def _due(self, frame_time):
+        # A timestamp going back means the stream restarted. Rounding keeps
+        # frame timestamps that are a float error short of the interval.
+        return self.last_kept is None or frame_time < self.last_kept or round(frame_time - self.last_kept, 6) >= self.sample_interval
+
+    def read(self):
+        """
+        Return (True, frame) for the next kept frame, or (False, None) at the
+        end of the stream or after a read error, which sleeps with backoff.
+        """
+        try:
+            for packet in self.packets:
+                if packet.size == 0:
+                    continue
+                self.last_grab = time.monotonic()
+                packet_time = self._packet_time(packet)
+                if self.realtime:
+                    if self.replay_start is None:
+                        self.replay_start = (time.monotonic(), packet_time)
+                    _replay_wait(self.replay_start[0], packet_time - self.replay_start[1])
+                if self.auto:
+                    self._measure(packet, packet_time)
+                if self.keyframes_only and not (packet.is_keyframe and self._due(packet_time)):
+                    continue
+                if self.wait_for_keyframe:
+                    if not packet.is_keyframe:
+                        continue
+                    self.wait_for_keyframe = False
+                start = time.perf_counter()
+                frames = packet.decode()
+                decode_seconds = time.perf_counter() - start
+                for frame in frames:
+                    frame_time = packet_time if frame.time is None else frame.time
+                    if self._due(frame_time):
+                        self.last_kept = frame_time
+                        self.decode_seconds = decode_seconds
+                        self.backoff = MIN_BACKOFF
+                        return True, frame.to_ndarray(format="bgr24")
+        except av.error.FFmpegError:
+            pass
+        time.sleep(self.backoff)
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+        return False, None
+
+
+class LatestFrameReader:
+    """
+    Read a sampler on a dedicated thread and keep only its newest frame.
+
+    The stream is read as fast as it delivers, so the capture buffers never
+    fill up, while the caller takes frames at its own pace. A frame the
+    caller did not take before the next one arrived is dropped, so a slow
+    caller gets fresh frames less often rather than old frames.
+    """
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.condition = threading.Condition()
+        self._slot = None  # (frame, capture time, decode seconds) of the newest frame
+        self.sequence = 0  # Frames read by the thread
+        self.taken = 0  # Sequence of the last frame taken
+        self.skipped = 0  # Frames dropped between the last two frames taken
+        self.capture_time = None  # Wall clock time the last frame taken was read
+        self.decode_seconds = 0.0
+        self.error = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while not self.stopped:
+                ret, frame = self.sampler.read()
+                if not ret:
+                    continue
+                with self.condition:
+                    self._slot = (frame, time.time(), self.sampler.decode_seconds)
+                    self.sequence += 1
+                    self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.error = e
+                self.stopped = True
+                self.condition.notify_all()
+
+    def read(self, timeout=1.0):
+        """
+        Return (True, frame) with the newest frame not taken yet, waiting up
+        to timeout seconds for one, or (False, None). Raises the error that
+        stopped the reading thread, if any.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > self.taken or self.stopped, timeout)
+            if self.error is not None:
+                raise self.error
+            if self.sequence == self.taken:
+                return False, None
+            self.skipped = self.sequence - self.taken - 1
+            self.taken = self.sequence
+            frame, self.capture_time, self.decode_seconds = self._slot
+            self._slot = None
+            return True, frame
+
+    def idle_seconds(self):
+        """
+        Seconds since the stream last delivered anything. Unlike the time
+        since the last frame taken, this stays low for a camera sampled
+        every few seconds as long as its stream keeps coming.
+        """
+        return time.monotonic() - self.sampler.last_grab
+
+    def stop(self):
+        """Stop the thread and wait for its current read, before the stream is released."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+def open_stream(url, options=None, decode_mode="all"):
+    """Open a stream with the reader the decode mode needs."""
+    return open_capture(url, options) if decode_mode == "all" else AvCapture(url, options)
+
+
+def create_sampler(cap, frame_interval=25, target_fps=None, decode_mode="all", realtime=False):
+    """Return the sampler of a stream opened with open_stream()."""
+    if decode_mode == "all":
+        return FrameSampler(cap, frame_interval, target_fps, realtime=realtime)
+    return KeyframeSampler(cap, frame_interval, target_fps, auto=decode_mode == "auto", realtime=realtime)
@@ -1,304 +1,766 @@
-
-import pika
-import time
-import cv2
-import pickle  # To serialize frames
-import struct  # To send the size of the frame
-from multiprocessing import Process, current_process
-import logging
-import datetime
-import threading
-import requests
-
-
-# Function to send logs to RabbitMQ
-def send_log_to_rabbitmq(log_message):
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq', heartbeat=600))
-        channel = connection.channel()
-        channel.queue_declare(queue='anpr_logs')  # Declare the queue for logs
-        
-        # Serialize the log message as JSON and send it to RabbitMQ
-        channel.basic_publish(
-            exchange='',
-            routing_key='anpr_logs',
-            body=pickle.dumps(log_message)
-        )
-        connection.close()
-    except Exception as e:
-        print(f"Failed to send log to RabbitMQ: {e}")
-
-# Wrapper functions for logging and sending logs to RabbitMQ
-def log_info(message):
-    logging.info(message)
-    current_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    message_data = {
-        "log_level" : "INFO",
-        "Event_Type":"Start threads for send frames",
-        "Message":message,
-        "datetime":current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)
-
-def log_error(message):
-    logging.info(message)
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    message_data = {
-        "log_level" : "ERROR",
-        "Event_Type":"Start threads for send frames",
-        "Message":message,
-        "datetime" : current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)    
-
-def log_exception(message):
-    logging.error(message)
-    current_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    message_data = {
-        "log_level" : "EXCEPTION",
-        "Event_Type":"Start threads for send frames",
-        "Message":message,
-        "datetime" : current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Dictionary to keep track of camera processes
-camera_processes = {}
-
-def setup_rabbitmq_connection(queue_name, rabbitmq_host, retries=5, retry_delay=5):
-    """
-    Set up a RabbitMQ connection and declare the queue.
-    """
-    for attempt in range(retries):
-        try:
-            connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host, heartbeat=600))
-            channel = connection.channel()
-            channel.queue_declare(queue=queue_name)
-            log_info(f"Connected to RabbitMQ at {rabbitmq_host}")
-            return connection, channel
-        except pika.exceptions.AMQPConnectionError as e:
-            log_error(f"RabbitMQ connection failed (attempt {attempt+1}/{retries}): {e}")
-            time.sleep(retry_delay)
-    raise log_exception(f"Could not connect to RabbitMQ after {retries} attempts")
-
-def process_video(camera_url, camera_id, camera_ip, objectlist, user_id, credit_id, rabbitmq_host, queue_name, frame_interval, retry_limit=50):
-    """
-    Process the video stream and send frames to RabbitMQ.
-    """
-    retry_count = 0
-    while retry_count < retry_limit:
-        cap = cv2.VideoCapture(camera_url)
-
-        if not cap.isOpened():
-            log_error(f"Error: Could not open video stream from {camera_url}")
-            retry_count += 1
-            time.sleep(5)
-            continue
-
-        log_info(f"Processing video stream from {camera_id}")
-        connection, channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
-
-        frame_count = 0
-        last_frame_time = time.time()
-
-        try:
-            while cap.isOpened():
-                ret, frame = cap.read()
-
-                if not ret:
-                    if time.time() - last_frame_time > 5:
-                        log_error(f"No frame received for 5 seconds from {camera_id}, restarting...")
-                        break
-                    continue
-
-                last_frame_time = time.time()
-
-                frame_count += 1
-                if frame_count % frame_interval != 0:
-                    continue
-
-                frame_count = 0
-                current_datetime = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-                frame_data = {
-                    "camera_id": camera_id,
-                    "camera_ip": camera_ip,
-                    "object_list": objectlist,
-                    "datetime": current_datetime,
-                    "frame": frame,
-                    "user_id": user_id,
-                    "credit_id": credit_id,
-                }
-                serialized_frame = pickle.dumps(frame_data)
-
-                channel.basic_publish(
-                    exchange="",
-                    routing_key=queue_name,
-                    body=serialized_frame
-                )
-                log_info(f"Sent a frame from camera {camera_id} (Process ID: {current_process().pid})")
-
-        except Exception as e:
-            log_exception(f"An error occurred in camera {camera_id}: {e}")
-        finally:
-            cap.release()
-            connection.close()
-            log_info(f"Camera {camera_id}: Video processing complete. RabbitMQ connection closed.")
-            retry_count += 1
-            if retry_count >= retry_limit:
-                log_error(f"Failed to process video stream after {retry_count} retries.")
-                break
-
-# Dictionary to keep track of camera URLs by their IDs
-camera_urls = {}
-user_ids ={}
-credit_ids = {}
-
-def start_camera_process(camera_url, camera_id, camera_ip, objectlist, user_id, credit_id, rabbitmq_host, queue_name="all_frames", frame_interval=25):
-    """
-    Start a separate process for each camera.
-    """
-    process = Process(target=process_video, args=(camera_url, camera_id, camera_ip, objectlist, user_id, credit_id, rabbitmq_host, queue_name, frame_interval))
-    process.start()
-    camera_processes[camera_id] = process  # Store process in the dictionary
-    camera_urls[camera_id] = camera_url  # Store the camera URL for later use
-    user_ids[camera_id] = user_id   # Store the user
-    credit_ids[camera_id] = credit_id  # Store the credit ID for later use
-    log_info(f"Started a new process for camera {camera_id} (Process ID: {process.pid})")
-    return process
-
-
-def stop_camera_process(camera_id):
-    """
-    Stop the camera process if it's running.
-    """
-    process = camera_processes.get(camera_id)
-    if process and process.is_alive():
-        log_info(f"Stopping process for camera {camera_id}")
-        process.terminate()
-        process.join()
-        log_info(f"Camera {camera_id}: Process stopped.")
-        del camera_processes[camera_id]  # Remove from dictionary
-    else:
-        log_error(f"No active process found for camera {camera_id}")
-
-
-camera_status = {}
-
-def monitor_camera_processes(rabbitmq_host="rabbitmq", queue_name="all_frames", frame_interval=15):
-    while True:
-        for camera_id, process in list(camera_processes.items()):
-            # Check if camera status is set to False; if so, stop and remove from monitoring
-            if not camera_status.get(camera_id, True):
-                if process.is_alive():
-                    log_info(f"Stopping camera process for {camera_id} as status is set to False.")
-                    stop_camera_process(camera_id)
-                continue  # Skip this camera for now since it shouldn't be monitored
-
-            # If process has stopped and status is True, restart it
-            if not process.is_alive():
-                log_info(f"Process for camera {camera_id} has stopped unexpectedly. Attempting to restart...")
-
-                # Fetch the camera URL from the stored dictionary
-                if camera_id in camera_urls:
-                    camera_url = camera_urls[camera_id]
-                    user_id = user_ids.get(camera_id)
-                    credit_id = credit_ids.get(camera_id)
-                    start_camera_process(camera_url, camera_id, user_id, credit_id, rabbitmq_host, queue_name, frame_interval)
-                else:
-                    log_error(f"No URL found for camera {camera_id}, unable to restart.")
-                    
-        time.sleep(25)  # Check every 25 seconds
-
-def fetch_camera_data_from_queue(queue_name, rabbitmq_host="rabbitmq"):
-
-    BaseUrl = "https://vmsapi3.ajeevi.in"
-
-    url = f'{BaseUrl}/api/VideoAnalytic/GetAllActive'
-    #datas=[]
-    try:
-        # Sending a GET request to the URL
-        response = requests.get(url)
-        
-        # Check if the request was successful
-        response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
-
-        # Parsing the response as JSON (if the API returns JSON)
-        datas = response.json()
-
-        print("Camera details:" ,datas)
-
-    except requests.exceptions.HTTPError as http_err:
-        print(f"HTTP error occurred: {http_err}")
-    except requests.exceptions.ConnectionError as conn_err:
-        print(f"Error connecting to {url}: {conn_err}")
-    except requests.exceptions.Timeout as timeout_err:
-        print(f"Timeout error: {timeout_err}")
-    except requests.exceptions.RequestException as req_err:
-        print(f"An error occurred: {req_err}")
-    except ValueError as json_err:
-        print(f"JSON decoding failed: {json_err}")
-    
-    for data in datas:
-        print(data)
-        print(data["cameraId"],data["cameraIP"],data["rtspUrl"],data["objectList"])
-        camera_id=data["cameraId"]
-        camera_ip=data["cameraIP"]
-        camera_url=data["rtspUrl"]   # have status true
-        objectlist=data["ObjectList"]
-        #print("First object list : ",objectlist)
-        #start_camera_process(camera_url, camera_id,camera_ip, objectlist, rabbitmq_host)
-
-
-    """
-    Fetch camera ID and RTSP URL from RabbitMQ queue and manage the camera processes.
-    """
-    connection, channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
-    
-    def callback(ch, method, properties, body):
-        try:
-            camera_data = pickle.loads(body)
-            
-            camera_id = camera_data.get("CameraId")
-            camera_ip = camera_data.get("CameraIp")
-            running_status = camera_data.get("Running").upper()
-            objectlist = camera_data.get("ObjectList")
-            camera_url = camera_data.get("CameraUrl")
-            user_id = camera_data.get("UserId")
-            credit_id = camera_data.get("CreditId")
-            #print("Second object list : ", objectlist)
-
-            if running_status == "TRUE":
-                camera_status[camera_id] = True
-                # Start process if not already running
-                if camera_id not in camera_processes or not camera_processes[camera_id].is_alive():
-                    log_info(f"Starting camera process for {camera_id}.")
-                    start_camera_process(camera_url, camera_id,camera_ip, objectlist, user_id, credit_id, rabbitmq_host)
-            else:
-                # Set status to False and stop process if running
-                camera_status[camera_id] = False
-                if camera_id in camera_processes and camera_processes[camera_id].is_alive():
-                    log_info(f"Stopping camera process for {camera_id}.")
-                    stop_camera_process(camera_id)
-
-        except Exception as e:
-            log_exception(f"Failed to process message from RabbitMQ: {e}")
-
-    # Start consuming the queue
-    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
-    log_info(f"Waiting for camera data from queue {queue_name}...")
-    channel.start_consuming()
-
-if __name__ == "__main__":
-    # Start the monitor thread
-    monitor_thread = threading.Thread(target=monitor_camera_processes, daemon=True)
-    monitor_thread.start()
-    
-    # Fetch camera ID and RTSP URL from RabbitMQ queue 'details'
-    fetch_camera_data_from_queue(queue_name="camera_details")
+import pika
+import os
+import time
+from multiprocessing import Process, Queue, current_process
+import collections
+import itertools
+import logging
+import datetime
+import threading
+import requests
+from frame_codec import encode_frame, get_encode_settings
+from motion_gate import create_motion_gate
+from roi import create_roi
+from shm_transport import FRAME_TRANSPORT, FrameRing, unlink_rings_on_terminate
+from message_schema import pack_message, unpack_message
+from metrics import CAMERA_FRAMES, REGISTRY, STAGE_SECONDS, histogram, start_metrics_server
+from video_capture import PYAV_AVAILABLE, LatestFrameReader, capture_options, create_sampler, get_decode_mode, open_stream
+from rabbitmq_queues import queue_arguments
+from remote_logging import get_remote_logger
+
+
+# Logger that also ships records to RabbitMQ, in batches from a background thread
+logger = get_remote_logger("frame_sender", "Start threads for send frames")
+
+# Wrapper functions for logging and sending logs to RabbitMQ
+def log_info(message):
+    logger.info(message)
+
+def log_error(message):
+    logger.error(message)
+
+def log_exception(message):
+    logger.error(message, extra={"log_level": "EXCEPTION"})
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# How often each camera logs its motion gate counters, in seconds
+MOTION_STATS_INTERVAL = 300
+
+# Number of capture worker processes, each running many cameras on threads.
+# 0 keeps one process per camera, "auto" starts one worker per CPU core.
+CAPTURE_WORKERS = os.getenv("CAPTURE_WORKERS", "0")
+CAPTURE_WORKERS = os.cpu_count() if CAPTURE_WORKERS == "auto" else int(CAPTURE_WORKERS)
+# How long to wait for a camera thread to stop, in seconds
+CAMERA_STOP_TIMEOUT = 10
+# Unconfirmed frames a publisher may have in flight
+PUBLISH_WINDOW = int(os.getenv("PUBLISH_WINDOW", "20"))
+# Frames each camera may have waiting to be published, older ones are dropped
+PER_CAMERA_PENDING = int(os.getenv("PER_CAMERA_PENDING", "2"))
+# Pause after the broker rejects a frame, and between reconnects, in seconds
+PUBLISH_NACK_BACKOFF = 0.2
+PUBLISH_RETRY_DELAY = 5
+# How often a publisher logs its counters, in seconds
+PUBLISH_STATS_INTERVAL = 300
+# Port of the /metrics endpoint, and how often camera and capture worker
+# processes send their metrics to the main process, in seconds
+METRICS_PORT = 9101
+METRICS_PUSH_INTERVAL = 5
+# Fanout exchange on which the main streams of cameras analysed on a
+# substream are sent to the writers, and how often, in seconds
+SNAPSHOT_SOURCES_EXCHANGE = "snapshot_sources"
+SNAPSHOT_SOURCES_INTERVAL = 30
+FRAME_AGE_SECONDS = histogram("vms_frame_age_seconds", "Age of frames when the sender takes them from the camera's capture thread", ("camera",))
+
+# Dictionary to keep track of camera processes
+camera_processes = {}
+
+def setup_rabbitmq_connection(queue_name, rabbitmq_host, retries=5, retry_delay=5):
+    """
+    Set up a RabbitMQ connection and declare the queue.
+    """
+    for attempt in range(retries):
+        try:
+            connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host, heartbeat=600))
+            channel = connection.channel()
+            channel.queue_declare(queue=queue_name, arguments=queue_arguments(queue_name))
+            log_info(f"Connected to RabbitMQ at {rabbitmq_host}")
+            return connection, channel
+        except pika.exceptions.AMQPConnectionError as e:
+            log_error(f"RabbitMQ connection failed (attempt {attempt+1}/{retries}): {e}")
+            time.sleep(retry_delay)
+    raise log_exception(f"Could not connect to RabbitMQ after {retries} attempts")
+
+class FramePublisher:
+    """
+    Publish frames for any number of camera threads over one RabbitMQ connection.
+
+    The connection is owned by a background thread running pika's IO loop and
+    uses publisher confirms, with at most `window` unconfirmed frames in flight.
+    Each camera keeps at most `per_camera_pending` frames waiting. When the broker
+    pushes back (full window, a nack from the queue's overflow policy or a
+    blocked connection) the camera's oldest frame is dropped, so camera
+    threads never block and the frames that do get through stay fresh.
+    """
+
+    def __init__(self, queue_name, rabbitmq_host, window=PUBLISH_WINDOW, per_camera_pending=PER_CAMERA_PENDING):
+        self.queue_name = queue_name
+        self.rabbitmq_host = rabbitmq_host
+        self.window = window
+        self.per_camera_pending = per_camera_pending
+        self.lock = threading.Lock()
+        self.pending = {}  # camera_id -> deque of frames waiting to be published
+        self.ready = collections.deque()  # cameras with waiting frames, served round robin
+        self.outstanding = collections.OrderedDict()  # delivery tag -> (camera_id, time the frame was queued)
+        self.delivery_tag = 0
+        self.connection = None
+        self.channel = None
+        self.paused = False
+        self.closing = False
+        self.stats = collections.Counter()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def publish(self, camera_id, body):
+        with self.lock:
+            frames = self.pending.get(camera_id)
+            if frames is None:
+                frames = self.pending[camera_id] = collections.deque(maxlen=self.per_camera_pending)
+            if not frames:
+                self.ready.append(camera_id)
+            elif len(frames) == frames.maxlen:
+                self.stats["dropped"] += 1
+                CAMERA_FRAMES.inc(camera=camera_id, step="dropped")
+            frames.append((body, time.perf_counter()))
+        self._call_in_loop(self._pump)
+
+    def close(self):
+        self.closing = True
+        self._call_in_loop(self._close_connection)
+        self.thread.join(timeout=CAMERA_STOP_TIMEOUT)
+
+    def _call_in_loop(self, callback):
+        connection = self.connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(callback)
+            except Exception:
+                pass  # The loop is shutting down, the frame waits for the next connection
+
+    def _run(self):
+        while not self.closing:
+            self.connection = pika.SelectConnection(
+                pika.ConnectionParameters(host=self.rabbitmq_host, heartbeat=600),
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            self.connection.ioloop.start()
+            # Frames that were never confirmed are lost with the connection
+            self.stats["dropped"] += len(self.outstanding)
+            for camera_id, queued_at in self.outstanding.values():
+                CAMERA_FRAMES.inc(camera=camera_id, step="dropped")
+            self.outstanding.clear()
+            self.channel = None
+            if not self.closing:
+                time.sleep(PUBLISH_RETRY_DELAY)
+
+    def _close_connection(self):
+        if self.connection.is_open:
+            self.connection.close()
+        elif not self.connection.is_closing:
+            self.connection.ioloop.stop()
+
+    def _on_connection_open(self, connection):
+        connection.add_on_connection_blocked_callback(self._on_blocked)
+        connection.add_on_connection_unblocked_callback(self._on_unblocked)
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        log_error(f"RabbitMQ connection for publishing to {self.queue_name} failed: {error}")
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        if not self.closing:
+            log_error(f"RabbitMQ connection for publishing to {self.queue_name} closed: {reason}")
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.queue_declare(
+            queue=self.queue_name,
+            arguments=queue_arguments(self.queue_name),
+            callback=lambda frame: self._on_queue_declared(channel),
+        )
+
+    def _on_channel_closed(self, channel, reason):
+        self.channel = None
+        if self.connection.is_open:
+            self.connection.close()
+
+    def _on_queue_declared(self, channel):
+        channel.confirm_delivery(self._on_confirm)
+        self.channel = channel
+        self.delivery_tag = 0
+        self.paused = False
+        log_info(f"Connected to RabbitMQ at {self.rabbitmq_host} for publishing to {self.queue_name}")
+        self.connection.ioloop.call_later(PUBLISH_STATS_INTERVAL, self._log_stats)
+        self._pump()
+
+    def _on_blocked(self, connection, frame):
+        log_error(f"RabbitMQ blocked publishing to {self.queue_name}, dropping old frames meanwhile")
+        self.paused = True
+
+    def _on_unblocked(self, connection, frame):
+        log_info(f"RabbitMQ unblocked publishing to {self.queue_name}")
+        self._resume()
+
+    def _resume(self):
+        self.paused = False
+        self._pump()
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        nacked = isinstance(method, pika.spec.Basic.Nack)
+        if method.multiple:
+            while self.outstanding and next(iter(self.outstanding)) <= method.delivery_tag:
+                self._confirmed(self.outstanding.popitem(last=False)[1], nacked)
+        elif method.delivery_tag in self.outstanding:
+            self._confirmed(self.outstanding.pop(method.delivery_tag), nacked)
+        if nacked and not self.paused:
+            # The queue is full, give the consumers a moment before sending more
+            self.paused = True
+            self.connection.ioloop.call_later(PUBLISH_NACK_BACKOFF, self._resume)
+            return
+        self._pump()
+
+    def _confirmed(self, frame, nacked):
+        camera_id, queued_at = frame
+        self.stats["nacked" if nacked else "confirmed"] += 1
+        CAMERA_FRAMES.inc(camera=camera_id, step="rejected" if nacked else "published")
+        STAGE_SECONDS.observe(time.perf_counter() - queued_at, stage="publish")
+
+    def _pump(self):
+        """Publish waiting frames, round robin across cameras, while the window has room."""
+        if self.channel is None or not self.channel.is_open or self.paused:
+            return
+        while len(self.outstanding) < self.window:
+            with self.lock:
+                if not self.ready:
+                    return
+                camera_id = self.ready.popleft()
+                frames = self.pending[camera_id]
+                body, queued_at = frames.popleft()
+                if frames:
+                    self.ready.append(camera_id)
+            self.channel.basic_publish(exchange="", routing_key=self.queue_name, body=body)
+            self.delivery_tag += 1
+            self.outstanding[self.delivery_tag] = (camera_id, queued_at)
+            self.stats["published"] += 1
+
+    def _log_stats(self):
+        stats = self.stats
+        log_info(
+            f"Publisher for {self.queue_name}: {stats['published']} published, {stats['confirmed']} confirmed, "
+            f"{stats['nacked']} rejected by the broker, {stats['dropped']} dropped"
+        )
+        if self.channel is not None:
+            self.connection.ioloop.call_later(PUBLISH_STATS_INTERVAL, self._log_stats)
+
+
+def _stopped(stop_event):
+    return stop_event is not None and stop_event.is_set()
+
+
+def process_video(camera_url, camera_id, camera_ip, objectlist, user_id, credit_id, rabbitmq_host, queue_name, frame_interval, retry_limit=50, options=None, publisher=None, stop_event=None):
+    """
+    Process the video stream and send frames to RabbitMQ.
+    Frames are sampled at the camera's TargetFps option, or every frame_interval
+    frames without one, and only the sampled frames are decoded.
+    Frames are compressed with the camera's encode settings before publishing,
+    or with FRAME_TRANSPORT=shm written to a shared memory ring of the camera.
+    If the camera has a motion threshold, frames of a static scene are skipped.
+    The camera's Tracking option asks analytics to alert once per object track.
+    With a region of interest, frames are cropped to it before anything else.
+    Streams are opened with the camera's FFmpeg capture options. A camera
+    with a SubstreamUrl is analysed on that lower resolution stream, and
+    its main stream is only opened by the writer for alert snapshots.
+    With the DecodeMode option "keyframes" or "auto", only the keyframes a
+    low sample rate needs are decoded.
+    The stream is read on its own thread that keeps only the newest frame,
+    so a slow publish skips frames instead of letting them grow old. The
+    Realtime option reads a video file at its frame rate, like a camera.
+
+    In a capture worker, frames go through the worker's shared publisher and
+    the camera thread exits when stop_event is set.
+    """
+    encode_settings = get_encode_settings(options)
+    motion_gate = create_motion_gate(options)
+    target_fps = float((options or {}).get("TargetFps") or 0)
+    tracking = bool((options or {}).get("Tracking"))
+    roi = create_roi(options)
+    inference_size = int((options or {}).get("InferenceSize") or 0) or None
+    substream_url = (options or {}).get("SubstreamUrl")
+    capture_url = substream_url or camera_url
+    decode_mode = get_decode_mode(options)
+    realtime = bool((options or {}).get("Realtime"))
+    if decode_mode != "all" and not PYAV_AVAILABLE:
+        log_error(f"Camera {camera_id}: DecodeMode {decode_mode} needs PyAV, which is not installed, decoding every frame")
+        decode_mode = "all"
+    roi_metadata = None
+    last_motion_stats = time.time()
+    own_publisher = publisher is None
+    if own_publisher:
+        publisher = FramePublisher(queue_name, rabbitmq_host)
+    # With the shared memory transport only a descriptor of the frame is published
+    ring = FrameRing(camera_id) if FRAME_TRANSPORT == "shm" else None
+    retry_count = 0
+    try:
+        while retry_count < retry_limit and not _stopped(stop_event):
+            cap = open_stream(capture_url, options, decode_mode)
+
+            if not cap.isOpened():
+                log_error(f"Error: Could not open video stream from {capture_url}")
+                retry_count += 1
+                if stop_event is not None:
+                    stop_event.wait(5)
+                else:
+                    time.sleep(5)
+                continue
+
+            log_info(f"Processing video stream from {camera_id}")
+
+            reader = LatestFrameReader(create_sampler(cap, frame_interval, target_fps, decode_mode, realtime))
+
+            try:
+                while cap.isOpened() and not _stopped(stop_event):
+                    ret, frame = reader.read()
+
+                    if not ret:
+                        # A camera sampled every few seconds has no frame to take most of the time,
+                        # so only a stream that stopped delivering altogether is restarted
+                        if reader.idle_seconds() > 5:
+                            log_error(f"No frame received for 5 seconds from {camera_id}, restarting...")
+                            break
+                        continue
+
+                    capture_time = reader.capture_time
+                    FRAME_AGE_SECONDS.observe(time.time() - capture_time, camera=camera_id)
+                    STAGE_SECONDS.observe(reader.decode_seconds, stage="stream_decode")
+                    CAMERA_FRAMES.inc(camera=camera_id, step="captured")
+                    if reader.skipped:
+                        # Newer frames replaced these before this loop got to them
+                        CAMERA_FRAMES.inc(reader.skipped, camera=camera_id, step="superseded")
+
+                    if roi is not None:
+                        frame, roi_metadata = roi.crop(frame)
+
+                    if motion_gate is not None:
+                        if time.time() - last_motion_stats > MOTION_STATS_INTERVAL:
+                            last_motion_stats = time.time()
+                            stats = motion_gate.stats()
+                            log_info(f"Camera {camera_id}: motion gate skipped {stats['skipped']} of {stats['checked']} frames")
+                        if not motion_gate.check(frame):
+                            CAMERA_FRAMES.inc(camera=camera_id, step="skipped_motion")
+                            continue
+
+                    current_datetime = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    with STAGE_SECONDS.time(stage="encode"):
+                        frame_payload = ring.write(frame, **encode_settings) if ring is not None else encode_frame(frame, **encode_settings)
+
+                    frame_data = {
+                        "camera_id": camera_id,
+                        "camera_ip": camera_ip,
+                        "object_list": objectlist,
+                        "datetime": current_datetime,
+                        "frame": frame_payload,
+                        "user_id": user_id,
+                        "credit_id": credit_id,
+                        "tracking": tracking,  # Alert once per object track instead of once per frame
+                        "roi": roi_metadata,  # ROI polygons in the cropped frame's coordinates
+                        "inference_size": inference_size,  # General model input size, None for the default
+                        "capture_time": capture_time,  # Carried through to the writer for end to end latency
+                    }
+                    serialized_frame = pack_message(frame_data)
+
+                    publisher.publish(camera_id, serialized_frame)
+                    log_info(f"Sent a frame from camera {camera_id} (Process ID: {current_process().pid})")
+
+            except Exception as e:
+                log_exception(f"An error occurred in camera {camera_id}: {e}")
+            finally:
+                reader.stop()
+                cap.release()
+                log_info(f"Camera {camera_id}: Video processing complete.")
+                retry_count += 1
+                if retry_count >= retry_limit:
+                    log_error(f"Failed to process video stream after {retry_count} retries.")
+                    break
+    finally:
+        if own_publisher:
+            publisher.close()
+        if ring is not None:
+            ring.close()
+
+
+metrics_queue = Queue()
+
+
+def _push_metrics():
+    while True:
+        time.sleep(METRICS_PUSH_INTERVAL)
+        delta = REGISTRY.take_delta()
+        if delta:
+            metrics_queue.put(delta)
+
+
+def start_metrics_push():
+    """
+    Send the metrics of this camera or capture worker process to the main
+    process, which serves them, every METRICS_PUSH_INTERVAL seconds.
+    """
+    REGISTRY.reset()  # Drop the values inherited from the main process
+    threading.Thread(target=_push_metrics, daemon=True).start()
+
+
+def collect_metrics():
+    """Merge the metrics sent by camera and capture worker processes."""
+    while True:
+        REGISTRY.merge(metrics_queue.get())
+
+
+def _run_camera_process(*args, **kwargs):
+    unlink_rings_on_terminate()
+    start_metrics_push()
+    process_video(*args, **kwargs)
+
+
+def _run_pooled_camera(camera_id, run_id, args, kwargs, publisher, stop_event, status):
+    status.put(("started", camera_id, run_id))
+    try:
+        process_video(*args, publisher=publisher, stop_event=stop_event, **kwargs)
+    except Exception as e:
+        log_exception(f"Camera {camera_id} thread failed: {e}")
+    finally:
+        status.put(("stopped", camera_id, run_id))
+
+
+def capture_worker(commands, status, queue_name, rabbitmq_host):
+    """
+    Worker process that runs many camera readers on threads.
+    All cameras of the worker share one publisher and RabbitMQ connection.
+    """
+    unlink_rings_on_terminate()
+    start_metrics_push()
+    publisher = FramePublisher(queue_name, rabbitmq_host)
+    stop_events = {}
+    while True:
+        command, camera_id, run_id, args, kwargs = commands.get()
+        if command == "start":
+            stop_event = threading.Event()
+            stop_events[camera_id] = stop_event
+            threading.Thread(
+                target=_run_pooled_camera,
+                args=(camera_id, run_id, args, kwargs, publisher, stop_event, status),
+                daemon=True
+            ).start()
+        elif command == "stop":
+            stop_event = stop_events.pop(camera_id, None)
+            if stop_event is not None:
+                stop_event.set()
+        elif command == "exit":
+            for stop_event in stop_events.values():
+                stop_event.set()
+            publisher.close()
+            break
+
+
+class PooledCamera:
+    """
+    Handle for a camera running in a capture worker. It offers the same
+    is_alive/terminate/join/pid interface as a Process, so camera_processes,
+    stop_camera_process and monitor_camera_processes work unchanged.
+    """
+
+    def __init__(self, pool, camera_id, run_id, worker):
+        self.pool = pool
+        self.camera_id = camera_id
+        self.run_id = run_id
+        self.worker = worker
+
+    @property
+    def pid(self):
+        return self.worker["process"].pid
+
+    def is_alive(self):
+        return self.worker["process"].is_alive() and self.pool.is_running(self.camera_id, self.run_id)
+
+    def terminate(self):
+        self.pool.stop_camera(self.camera_id)
+
+    def join(self, timeout=CAMERA_STOP_TIMEOUT):
+        deadline = time.time() + timeout
+        while self.is_alive() and time.time() < deadline:
+            time.sleep(0.1)
+
+
+class CaptureWorkerPool:
+    """
+    A fixed number of capture worker processes. Each new camera goes to the
+    worker with the lowest load, where a camera's load is its CaptureWeight
+    option (1 by default).
+    """
+
+    def __init__(self, size, queue_name, rabbitmq_host):
+        self.queue_name = queue_name
+        self.rabbitmq_host = rabbitmq_host
+        self.status = Queue()
+        self.lock = threading.Lock()
+        self.run_ids = itertools.count(1)
+        self.running = {}  # camera_id -> run_id of the live camera thread
+        self.workers = [self._start_worker() for _ in range(size)]
+        threading.Thread(target=self._collect_status, daemon=True).start()
+
+    def _start_worker(self):
+        commands = Queue()
+        process = Process(target=capture_worker, args=(commands, self.status, self.queue_name, self.rabbitmq_host))
+        process.start()
+        log_info(f"Started capture worker (Process ID: {process.pid})")
+        return {"process": process, "commands": commands, "cameras": {}}
+
+    def _collect_status(self):
+        while True:
+            event, camera_id, run_id = self.status.get()
+            with self.lock:
+                if event == "stopped" and self.running.get(camera_id) == run_id:
+                    del self.running[camera_id]
+
+    def _worker_of(self, camera_id):
+        for worker in self.workers:
+            if camera_id in worker["cameras"]:
+                return worker
+        return None
+
+    def is_running(self, camera_id, run_id):
+        with self.lock:
+            return self.running.get(camera_id) == run_id
+
+    def start_camera(self, camera_id, args, kwargs):
+        with self.lock:
+            # Replace workers that died, their cameras are restarted by the monitor
+            for index, worker in enumerate(self.workers):
+                if not worker["process"].is_alive():
+                    log_error(f"Capture worker (Process ID: {worker['process'].pid}) died, starting a new one")
+                    for lost_camera in worker["cameras"]:
+                        self.running.pop(lost_camera, None)
+                    self.workers[index] = self._start_worker()
+
+            previous = self._worker_of(camera_id)
+            if previous is not None:
+                previous["cameras"].pop(camera_id)
+            worker = min(self.workers, key=lambda w: sum(w["cameras"].values()))
+            worker["cameras"][camera_id] = float((kwargs.get("options") or {}).get("CaptureWeight") or 1)
+            run_id = next(self.run_ids)
+            self.running[camera_id] = run_id
+        worker["commands"].put(("start", camera_id, run_id, args, kwargs))
+        return PooledCamera(self, camera_id, run_id, worker)
+
+    def stop_camera(self, camera_id):
+        with self.lock:
+            worker = self._worker_of(camera_id)
+            if worker is None:
+                return
+            worker["cameras"].pop(camera_id)
+        worker["commands"].put(("stop", camera_id, None, None, None))
+
+
+# Pool of capture workers, None when every camera runs in its own process
+capture_pool = None
+
+
+# Dictionary to keep track of camera URLs by their IDs
+camera_urls = {}
+user_ids ={}
+credit_ids = {}
+camera_options = {}
+camera_ips = {}
+object_lists = {}
+
+def start_camera_process(camera_url, camera_id, camera_ip, objectlist, user_id, credit_id, rabbitmq_host, queue_name="all_frames", frame_interval=25, options=None):
+    """
+    Start a separate process for each camera, or a thread in the capture
+    worker pool when it is enabled.
+    """
+    args = (camera_url, camera_id, camera_ip, objectlist, user_id, credit_id, rabbitmq_host, queue_name, frame_interval)
+    if capture_pool is not None:
+        process = capture_pool.start_camera(camera_id, args, {"options": options})
+    else:
+        process = Process(target=_run_camera_process, args=args, kwargs={"options": options})
+        process.start()
+    camera_processes[camera_id] = process  # Store process in the dictionary
+    camera_urls[camera_id] = camera_url  # Store the camera URL for later use
+    camera_ips[camera_id] = camera_ip
+    object_lists[camera_id] = objectlist
+    user_ids[camera_id] = user_id   # Store the user
+    credit_ids[camera_id] = credit_id  # Store the credit ID for later use
+    camera_options[camera_id] = options or {}  # Store the per camera settings
+    log_info(f"Started a new process for camera {camera_id} (Process ID: {process.pid})")
+    return process
+
+
+def stop_camera_process(camera_id):
+    """
+    Stop the camera process if it's running.
+    """
+    process = camera_processes.get(camera_id)
+    if process and process.is_alive():
+        log_info(f"Stopping process for camera {camera_id}")
+        process.terminate()
+        process.join()
+        log_info(f"Camera {camera_id}: Process stopped.")
+        del camera_processes[camera_id]  # Remove from dictionary
+    else:
+        log_error(f"No active process found for camera {camera_id}")
+
+
+camera_status = {}
+
+def monitor_camera_processes(rabbitmq_host="rabbitmq", queue_name="all_frames", frame_interval=15):
+    while True:
+        for camera_id, process in list(camera_processes.items()):
+            # Check if camera status is set to False; if so, stop and remove from monitoring
+            if not camera_status.get(camera_id, True):
+                if process.is_alive():
+                    log_info(f"Stopping camera process for {camera_id} as status is set to False.")
+                    stop_camera_process(camera_id)
+                continue  # Skip this camera for now since it shouldn't be monitored
+
+            # If process has stopped and status is True, restart it
+            if not process.is_alive():
+                log_info(f"Process for camera {camera_id} has stopped unexpectedly. Attempting to restart...")
+
+                # Fetch the camera URL from the stored dictionary
+                if camera_id in camera_urls:
+                    camera_url = camera_urls[camera_id]
+                    user_id = user_ids.get(camera_id)
+                    credit_id = credit_ids.get(camera_id)
+                    start_camera_process(
+                        camera_url, camera_id, camera_ips.get(camera_id), object_lists.get(camera_id), user_id, credit_id,
+                        rabbitmq_host, queue_name, frame_interval, options=camera_options.get(camera_id)
+                    )
+                else:
+                    log_error(f"No URL found for camera {camera_id}, unable to restart.")
+                    
+        time.sleep(25)  # Check every 25 seconds
+
+def publish_snapshot_sources(rabbitmq_host="rabbitmq", interval=SNAPSHOT_SOURCES_INTERVAL):
+    """
+    Send the main streams of the running cameras that are analysed on a
+    substream to the writers, which take full resolution alert snapshots
+    from them. The URLs often hold credentials, so they are sent here, and
+    not with every frame and event.
+    """
+    connection = None
+    while True:
+        try:
+            if connection is None or not connection.is_open:
+                connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host))
+                channel = connection.channel()
+                channel.exchange_declare(exchange=SNAPSHOT_SOURCES_EXCHANGE, exchange_type="fanout")
+            sources = [
+                {"CameraId": camera_id, "Url": camera_urls[camera_id], "Options": capture_options(options)}
+                for camera_id, options in list(camera_options.items())
+                if options.get("SubstreamUrl") and camera_status.get(camera_id) and camera_id in camera_urls
+            ]
+            channel.basic_publish(exchange=SNAPSHOT_SOURCES_EXCHANGE, routing_key="", body=pack_message({"Sources": sources}))
+            connection.sleep(interval)  # Keeps serving heartbeats
+        except Exception as e:
+            log_exception(f"Could not send the cameras' snapshot sources: {e}")
+            connection = None
+            time.sleep(interval)
+
+def fetch_camera_data_from_queue(queue_name, rabbitmq_host="rabbitmq"):
+
+    BaseUrl = "https://vmsapi3.ajeevi.in"
+
+    url = f'{BaseUrl}/api/VideoAnalytic/GetAllActive'
+    #datas=[]
+    try:
+        # Sending a GET request to the URL
+        response = requests.get(url)
+        
+        # Check if the request was successful
+        response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
+
+        # Parsing the response as JSON (if the API returns JSON)
+        datas = response.json()
+
+        print("Camera details:" ,datas)
+
+    except requests.exceptions.HTTPError as http_err:
+        print(f"HTTP error occurred: {http_err}")
+    except requests.exceptions.ConnectionError as conn_err:
+        print(f"Error connecting to {url}: {conn_err}")
+    except requests.exceptions.Timeout as timeout_err:
+        print(f"Timeout error: {timeout_err}")
+    except requests.exceptions.RequestException as req_err:
+        print(f"An error occurred: {req_err}")
+    except ValueError as json_err:
+        print(f"JSON decoding failed: {json_err}")
+    
+    for data in datas:
+        print(data)
+        print(data["cameraId"],data["cameraIP"],data["rtspUrl"],data["objectList"])
+        camera_id=data["cameraId"]
+        camera_ip=data["cameraIP"]
+        camera_url=data["rtspUrl"]   # have status true
+        objectlist=data["ObjectList"]
+        #print("First object list : ",objectlist)
+        #start_camera_process(camera_url, camera_id,camera_ip, objectlist, rabbitmq_host)
+
+
+    """
+    Fetch camera ID and RTSP URL from RabbitMQ queue and manage the camera processes.
+    """
+    connection, channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
+    
+    def callback(ch, method, properties, body):
+        try:
+            camera_data = unpack_message(body)
+            
+            camera_id = camera_data.get("CameraId")
+            camera_ip = camera_data.get("CameraIp")
+            running_status = camera_data.get("Running").upper()
+            objectlist = camera_data.get("ObjectList")
+            camera_url = camera_data.get("CameraUrl")
+            user_id = camera_data.get("UserId")
+            credit_id = camera_data.get("CreditId")
+            options = camera_data.get("Options") or {}
+            #print("Second object list : ", objectlist)
+
+            if running_status == "TRUE":
+                camera_status[camera_id] = True
+                # Start process if not already running
+                if camera_id not in camera_processes or not camera_processes[camera_id].is_alive():
+                    log_info(f"Starting camera process for {camera_id}.")
+                    start_camera_process(camera_url, camera_id,camera_ip, objectlist, user_id, credit_id, rabbitmq_host, options=options)
+            else:
+                # Set status to False and stop process if running
+                camera_status[camera_id] = False
+                if camera_id in camera_processes and camera_processes[camera_id].is_alive():
+                    log_info(f"Stopping camera process for {camera_id}.")
+                    stop_camera_process(camera_id)
+
+        except Exception as e:
+            log_exception(f"Failed to process message from RabbitMQ: {e}")
+
+    # Start consuming the queue
+    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+    log_info(f"Waiting for camera data from queue {queue_name}...")
+    channel.start_consuming()
+
+if __name__ == "__main__":
+    start_metrics_server(METRICS_PORT)
+    threading.Thread(target=collect_metrics, daemon=True).start()
+
+    if CAPTURE_WORKERS > 0:
+        capture_pool = CaptureWorkerPool(CAPTURE_WORKERS, "all_frames", "rabbitmq")
+
+    # Start the monitor thread
+    monitor_thread = threading.Thread(target=monitor_camera_processes, daemon=True)
+    monitor_thread.start()
+    threading.Thread(target=publish_snapshot_sources, daemon=True).start()
+    
+    # Fetch camera ID and RTSP URL from RabbitMQ queue 'details'
+    fetch_camera_data_from_queue(queue_name="camera_details")
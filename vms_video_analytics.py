@@ -1,324 +1,780 @@
-
-import pika
-import os
-import pickle  # To deserialize and serialize frames
-import struct  # To handle frame size unpacking
-from ultralytics import YOLO
-import datetime
-import cv2
-import logging
-import time
-import requests
-import math
-
-# List of YOLO object class names
-Object_list = ['Person', 'Bicycle', 'Car', 'Motorcycle', 'Airplane', 'Bus', 'Train', 'Truck', 'Boat', 'Traffic Light', 'Fire Hydrant', 
-               'Stop Sign', 'Parking Meter', 'Bench', 'Bird', 'Cat', 'Dog', 'Horse', 'Sheep', 'Cow', 'Elephant', 'Bear', 'Zebra', 
-               'Giraffe', 'Backpack', 'Umbrella', 'Handbag', 'Tie', 'Suitcase', 'Frisbee', 'Skis', 'Snowboard', 'Sports Ball', 'Kite', 
-               'Baseball Bat', 'Baseball Glove', 'Skateboard', 'Surfboard', 'Tennis Racket', 'Bottle', 'Wine Glass', 'Cup', 'Fork', 
-               'Knife', 'Spoon', 'Bowl', 'Banana', 'Apple', 'Sandwich', 'Orange', 'Broccoli', 'Carrot', 'Hot Dog', 'Pizza', 'Donut', 
-               'Cake', 'Chair', 'Couch', 'Potted Plant', 'Bed', 'Dining Table', 'Toilet', 'TV', 'Laptop', 'Mouse', 'Remote', 
-               'Keyboard', 'Cell Phone', 'Microwave', 'Oven', 'Toaster', 'Sink', 'Refrigerator', 'Book', 'Clock', 'Vase', 
-               'Scissors', 'Teddy Bear', 'Hair Drier', 'Toothbrush']
-
-# Cattle for detection
-CATTLE_CLASSES = ["cat", "dog", "horse", "sheep", "cow", "elephant", "bear", "zebra", "giraffe"]
-
-# Load the YOLO model
-model = YOLO("yolov8m.pt")
-seat_belt_model=YOLO("belt_mobile_65v8s_best.pt")
-helmet_model = YOLO("hemletYoloV8_100epochs.pt")
-
-
-# Function to send logs to RabbitMQ
-def send_log_to_rabbitmq(log_message):
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq', heartbeat=600))
-        channel = connection.channel()
-        channel.queue_declare(queue='anpr_logs')  # Declare the queue for logs
-        
-        # Serialize the log message as JSON and send it to RabbitMQ
-        channel.basic_publish(
-            exchange='',
-            routing_key='anpr_logs',
-            body=pickle.dumps(log_message)
-        )
-        connection.close()
-    except Exception as e:
-        print(f"Failed to send log to RabbitMQ: {e}")
-
-# Wrapper functions for logging and sending logs to RabbitMQ
-def log_info(message):
-    logging.info(message)
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    message_data = {
-        "log_level" : "INFO",
-        "Event_Type":"Start threads for send frames",
-        "Message":message,
-        "datetime" : current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)
-
-def log_error(message):
-    logging.info(message)
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    message_data = {
-        "log_level" : "ERROR",
-        "Event_Type":"Start threads for send frames",
-        "Message":message,
-        "datetime" : current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)    
-
-def log_exception(message):
-    logging.error(message)
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    message_data = {
-        "log_level" : "EXCEPTION",
-        "Event_Type":"Start threads for send frames",
-        "Message":message,
-        "datetime" : current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)
-
-
-# Directory to save frames 
-vehicle_frame = "vehicle_frame"
-os.makedirs(vehicle_frame, exist_ok=True)
-
-
-def setup_rabbitmq_connection(queue_name, rabbitmq_host, retries=5, retry_delay=5):
-    """
-    Set up a RabbitMQ connection and declare the queue.
-    """
-    for attempt in range(retries):
-        try:
-            connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host, heartbeat=600))
-            channel = connection.channel()
-            channel.queue_declare(queue=queue_name)
-            log_info(f"Connected to RabbitMQ at {rabbitmq_host}")
-            return connection, channel
-        except pika.exceptions.AMQPConnectionError as e:
-            log_error(f"RabbitMQ connection failed (attempt {attempt+1}/{retries}): {e}")
-            time.sleep(retry_delay)
-    raise log_exception(f"Could not connect to RabbitMQ after {retries} attempts")
-
-
-def publish_to_queue(camera_id, frame, processed_channel,processed_queue_name):
-    """Publish processed data to RabbitMQ."""
-    print("publish")
-    processed_frame_data = {
-        "camera_id": camera_id,
-        "frame": frame
-    }
-    serialized_frame = pickle.dumps(processed_frame_data)
-    processed_channel.basic_publish(exchange="", routing_key=processed_queue_name, body=serialized_frame)
-
-
-def process_cattle(frame, results):
-    """Process detections for 'Cattle on Road'."""
-    cattle_detected = 0
-    for result in results.boxes.data.tolist():
-        x1, y1, x2, y2, cattle_score, cattle_id = result
-        label = Object_list[cattle_id].lower()
-        if label in CATTLE_CLASSES and cattle_score > 0.5:
-            # Draw bounding box
-            cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-            cattle_detected += 1
-
-    return frame, cattle_detected
-
-
-def process_frame(ch, method, properties, body, processed_channel,processed_queue_name, rabbitmq_host):
-    """
-    Callback function to process the received frames from RabbitMQ.
-
-    Args:
-        ch, method, properties: RabbitMQ parameters.
-        body: The serialized frame data received from the queue.
-        processed_channel: RabbitMQ channel for sending processed frames.
-    """
-    if not processed_channel.is_open:
-        log_error("Receiver channel is closed. Attempting to reconnect.")
-        processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
-    try:
-        # Deserialize the frame and metadata
-        frame_data = pickle.loads(body)
-
-        camera_id = frame_data["camera_id"]
-        camera_ip = frame_data["camera_ip"]
-        object_list = frame_data["object_list"]
-        datetime = frame_data["datetime"]
-        frame = frame_data["frame"]
-        user_id = frame_data["user_id"]
-        credit_id = frame_data["credit_id"]
-        #print("Frame data :", frame_data)
-        # Detect and classify objects in the frame
-        detected_object = {}
-        flag = 0
-        object_for_detection = object_list
-
-        if not object_for_detection:
-            return frame, detected_object, flag
-        
-        results = model(frame, verbose=False)[0]
-        for result in results.boxes.data.tolist():
-            x1, y1, x2, y2, score, id = result
-            label = results.names[int(id)]
-            print("main label :", label)
-            print("score :", score)
-            if label in object_for_detection and score > 0.5:
-                # Serialize the frame and send it to the 'processed_frames' queue
-                flag = 1
-                cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                detected_object[label] = detected_object.get(label, 0) + 1
-                log_info(f"Detected object with label ans camera_id : {camera_id}")
-
-        if "Cattle on road" in object_for_detection:
-            #print("Cattle on road")
-            frame, cattle_count = process_cattle(frame, results)
-            if cattle_count > 0:
-                flag = 1
-                detected_object["Cattle"] = cattle_count  
-                log_info(f"Cattle detected successfully for camera_id : {camera_id}")
-
-        # Specific Rules: Without Seat Belt
-        if "Without Seat belt" in object_for_detection:
-            #print("Without Seat belt")
-            results2 = seat_belt_model(frame,verbose=False)[0]
-            for result in results2.boxes.data.tolist():
-                x1, y1, x2, y2, seat_score, seat_id = result
-                label_seat = results2.names[seat_id]
-                if label_seat == "no-seatbelt" and seat_score > .5:
-                    flag = 1
-                    publish_to_queue(camera_id, frame, processed_channel,processed_queue_name="detected_vehicle")
-                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2)), (0, 255, 0), 2)
-                    detected_object["Without Seat belt"] = detected_object.get("Without Seat belt", 0) + 1  
-                    log_info(f"Seat belt detected successfully for camera_id : {camera_id}")  
-
-
-        # Specific Rules: Without Helmet
-        if "Without Helmet" in object_for_detection:
-            #print("Without Helmet")
-            results3 = helmet_model(frame,verbose=False)[0]  # Detect HEAD using helmet model
-            head_boxes = []
-            
-            # Collect all HEAD detections
-            for result3 in results3.boxes.data.tolist():
-                hx1, hy1, hx2, hy2, helmet_score, helmet_id = result3
-                if results3.names[helmet_id] == "head" and helmet_score > .5:
-                    head_boxes.append((hx1, hy1, hx2, hy2))
-                    log_info(f"Head detected with camera_id :{camera_id}")
-            
-            # Check for motorcycles below detected HEADs
-            results4 = model(frame)  # General object detection
-            for result4 in results4:
-                mx1, my1, mx2, my2, motor_score, motor_id = result4
-                mlabel = results4.names[int(motor_id)]
-                if mlabel == "motorcycle" and motor_score > 0.5:
-                    # Check if any HEAD is above this motorcycle
-                    head_center_x = (hx1 + hx2) // 2
-                    head_center_y = (hy1 + hy2) // 2
-                    
-                    # Calculate motorcycle bounding box center
-                    moto_center_x = (mx1 + mx2) // 2
-                    moto_center_y = (my1 + my2) // 2
-                    
-                    # Calculate Euclidean distance
-                    distance = math.sqrt((head_center_x - moto_center_x)**2 + (head_center_y - moto_center_y)**2)
-                    
-                    # Check if the distance is within the threshold (e.g., 50 pixels)
-                    if distance < 100:
-                        # Publish to queue and annotate frame
-                        flag = 1
-                        publish_to_queue(camera_id, frame, processed_channel,processed_queue_name="detected_vehicle")
-                        detected_object["Without Helmet"] = detected_object.get("Without Helmet", 0) + 1
-                        color = (0, 255, 0)
-                        cv2.rectangle(frame, (int(mx1), int(my1)), (int(mx2), int(my2)), color, 2)
-                        cv2.rectangle(frame, (int(hx1), int(hy1)), (int(hx2), int(hy2)), (255, 0, 0), 2)
-                        log_info(f"Motorcycle detected with camera_id :{camera_id}")                       
-        # Serialize the processed license plate frame
-        #print("Detected object :", detected_object)
-        #print("object :", object_for_detection)
-        if detected_object:
-            image_info = {
-                "Event_Type":"Analytics",
-                "CameraId": camera_id,
-                'CameraIp': camera_ip,
-                'Datetime': datetime,
-                'Image': frame,
-                'Object': detected_object,
-                "UserId": user_id,
-                "CreditId": credit_id,
-            }
-            serialized_frame = pickle.dumps(image_info)
-            # Send the processed frame to the 'processed_frames' queue
-            processed_channel.basic_publish(
-                exchange="",
-                routing_key="video_analytics",
-                body=serialized_frame
-            )
-            log_info("Object detected successfully")
-    except Exception as e:
-        log_exception(f"Error processing frame: {e}")
-        processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
-
-def main(queue_name="all_frames", processed_queue_name="video_analytics", rabbitmq_host="rabbitmq"):
-    """
-    Main function to set up RabbitMQ connections for receiving and sending frames.
-
-    Args:
-        queue_name (str): The RabbitMQ queue to consume frames from. Defaults to 'video_frames'.
-        processed_queue_name (str): The RabbitMQ queue to send processed frames to. Defaults to 'processed_frames'.
-    """
-    # Set up RabbitMQ connection and channel for receiving frames
-    receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name,rabbitmq_host)
-
-    # Set up RabbitMQ connection and channel for sending processed frames
-    processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
-
-    # ---------------------------------------------------
-    if not receiver_channel.is_open:
-        log_error("Receiver channel is closed. Attempting to reconnect.")
-        receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
-    if not processed_channel.is_open:
-        log_error("Receiver channel is closed. Attempting to reconnect.")
-        processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)    
-
-    while True:
-        try:
-            if not receiver_channel.is_open:
-                log_error("Receiver channel is closed. Attempting to reconnect.")
-                time.sleep(25)
-                receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
-            if not processed_channel.is_open:
-                log_error("Receiver channel is closed. Attempting to reconnect.")
-                time.sleep(25)
-                processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
-            
-            receiver_channel.basic_consume(
-                queue=queue_name, 
-                on_message_callback=lambda ch, method, properties, body: process_frame(
-                    ch, method, properties, body, processed_channel,processed_queue_name, rabbitmq_host
-                ),
-                auto_ack=True
-            )
-            log_info("Waiting for video frames...")
-            receiver_channel.start_consuming()
-        
-        except pika.exceptions.ConnectionClosedByBroker as e:
-            log_error("Connection closed by broker, reconnecting...")
-            time.sleep(25)
-            receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
-            processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
-        except Exception as e:
-            log_exception(f"Unexpected error: {e}")
-            time.sleep(25)
-            continue 
-
-if __name__ == "__main__":
-    # Start the receiver and sender
-    main()
+
+import pika
+import os
+import struct  # To handle frame size unpacking
+import datetime
+import cv2
+import logging
+import time
+import requests
+import numpy as np
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from rabbitmq_queues import queue_arguments
+from frame_codec import decode_frame, encode_frame, get_envelope_settings
+from remote_logging import get_remote_logger
+from object_tracker import TrackerRegistry
+from roi import filter_boxes_by_roi
+from inference_backend import INFERENCE_BACKEND, WARMUP_RUNS
+from shm_transport import get_frame_reader, is_shm_descriptor
+from message_schema import pack_message, unpack_message
+from metrics import CAMERA_FRAMES, REGISTRY, STAGE_SECONDS, capture_age, start_metrics_server
+from model_registry import ModelRegistry
+
+# List of YOLO object class names
+Object_list = ['Person', 'Bicycle', 'Car', 'Motorcycle', 'Airplane', 'Bus', 'Train', 'Truck', 'Boat', 'Traffic Light', 'Fire Hydrant', 
+               'Stop Sign', 'Parking Meter', 'Bench', 'Bird', 'Cat', 'Dog', 'Horse', 'Sheep', 'Cow', 'Elephant', 'Bear', 'Zebra', 
+               'Giraffe', 'Backpack', 'Umbrella', 'Handbag', 'Tie', 'Suitcase', 'Frisbee', 'Skis', 'Snowboard', 'Sports Ball', 'Kite', 
+               'Baseball Bat', 'Baseball Glove', 'Skateboard', 'Surfboard', 'Tennis Racket', 'Bottle', 'Wine Glass', 'Cup', 'Fork', 
+               'Knife', 'Spoon', 'Bowl', 'Banana', 'Apple', 'Sandwich', 'Orange', 'Broccoli', 'Carrot', 'Hot Dog', 'Pizza', 'Donut', 
+               'Cake', 'Chair', 'Couch', 'Potted Plant', 'Bed', 'Dining Table', 'Toilet', 'TV', 'Laptop', 'Mouse', 'Remote', 
+               'Keyboard', 'Cell Phone', 'Microwave', 'Oven', 'Toaster', 'Sink', 'Refrigerator', 'Book', 'Clock', 'Vase', 
+               'Scissors', 'Teddy Bear', 'Hair Drier', 'Toothbrush']
+
+# Cattle for detection
+CATTLE_CLASSES = ["cat", "dog", "horse", "sheep", "cow", "elephant", "bear", "zebra", "giraffe"]
+CATTLE_CLASS_IDS = frozenset(i for i, name in enumerate(Object_list) if name.lower() in CATTLE_CLASSES)
+
+# Rule thresholds
+MIN_SCORE = 0.5
+HEAD_TO_MOTORCYCLE_DISTANCE = 100
+
+# Model run for each rule, None means the model runs for every frame
+DETECTOR_RULES = {
+    "general": None,
+    "seat_belt": "Without Seat belt",
+    "helmet": "Without Helmet",
+}
+
+# Specialist models only run on crops of these general detections. Margins grow
+# the crop by (left, top, right, bottom) fractions of the box, e.g. the rider's
+# head sits above the motorcycle box.
+SPECIALIST_CROPS = {
+    "seat_belt": {"classes": ("car", "truck"), "margins": (0.05, 0.05, 0.05, 0.05)},
+    "helmet": {"classes": ("motorcycle",), "margins": (0.25, 1.0, 0.25, 0.0)},
+}
+MIN_CROP_SIZE = 16
+
+# Weights of every model, loaded on the configured inference backend the
+# first time a frame's rules need them
+MODEL_WEIGHTS = {
+    "general": "yolov8m.pt",
+    "seat_belt": "belt_mobile_65v8s_best.pt",
+    "helmet": "hemletYoloV8_100epochs.pt",
+}
+
+
+# Logger that also ships records to RabbitMQ, in batches from a background thread
+logger = get_remote_logger("video_analytics", "Start threads for send frames")
+
+# Wrapper functions for logging and sending logs to RabbitMQ
+def log_info(message):
+    logger.info(message)
+
+def log_error(message):
+    logger.error(message)
+
+def log_exception(message):
+    logger.error(message, extra={"log_level": "EXCEPTION"})
+
+
+# Models loaded on demand (up front before forking pytorch inference workers),
+# unloaded after MODEL_IDLE_TTL idle seconds
+models = ModelRegistry(MODEL_WEIGHTS, logger=logger)
+
+
+# Batching of frames across cameras for inference, 1 disables batching
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "1"))
+BATCH_TIMEOUT_MS = int(os.getenv("BATCH_TIMEOUT_MS", "50"))
+
+# Inference worker processes with manual acks, 0 runs inference in the consumer
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+# Unacknowledged frames the broker may deliver to this consumer, 0 picks a
+# default from the number of workers and the batch size
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "0"))
+# Port of the /metrics endpoint
+METRICS_PORT = 9102
+
+# Directory to save frames 
+vehicle_frame = "vehicle_frame"
+os.makedirs(vehicle_frame, exist_ok=True)
+
+
+def setup_rabbitmq_connection(queue_name, rabbitmq_host, retries=5, retry_delay=5):
+    """
+    Set up a RabbitMQ connection and declare the queue.
+    """
+    for attempt in range(retries):
+        try:
+            connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host, heartbeat=600))
+            channel = connection.channel()
+            channel.queue_declare(queue=queue_name, arguments=queue_arguments(queue_name))
+            log_info(f"Connected to RabbitMQ at {rabbitmq_host}")
+            return connection, channel
+        except pika.exceptions.AMQPConnectionError as e:
+            log_error(f"RabbitMQ connection failed (attempt {attempt+1}/{retries}): {e}")
+            time.sleep(retry_delay)
+    raise log_exception(f"Could not connect to RabbitMQ after {retries} attempts")
+
+
+def publish_to_queue(camera_id, frame, processed_channel,processed_queue_name):
+    """Publish processed data to RabbitMQ."""
+    print("publish")
+    processed_frame_data = {
+        "camera_id": camera_id,
+        "frame": frame
+    }
+    serialized_frame = pack_message(processed_frame_data)
+    processed_channel.basic_publish(exchange="", routing_key=processed_queue_name, body=serialized_frame)
+
+
+def label_ids(names, labels):
+    """
+    Return the set of the model's class IDs whose label is in labels, either
+    a list of labels or the object list string the API sends, which is
+    matched by substring as before.
+    The result is cached per model names dict and labels.
+    """
+    key = (id(names), labels if isinstance(labels, str) else tuple(labels))
+    cached = _label_ids_cache.get(key)
+    if cached is None or cached[0] is not names:
+        wanted = labels if isinstance(labels, str) else set(labels)
+        cached = (names, frozenset(class_id for class_id, name in names.items() if name in wanted))
+        _label_ids_cache[key] = cached
+    return cached[1]
+
+_label_ids_cache = {}
+
+
+def filter_boxes(boxes, class_ids=None, min_score=MIN_SCORE):
+    """
+    Select the rows of an (N, 6) box array above min_score and, if given, in class_ids.
+    """
+    mask = boxes[:, 4] > min_score
+    if class_ids is not None:
+        mask &= np.isin(boxes[:, 5].astype(np.int64), np.fromiter(class_ids, dtype=np.int64, count=len(class_ids)))
+    return boxes[mask]
+
+
+def box_centers(boxes):
+    return (boxes[:, 0:2] + boxes[:, 2:4]) // 2
+
+
+def draw_boxes(frame, boxes, color=(0, 255, 0)):
+    for x1, y1, x2, y2 in boxes[:, :4].astype(np.int64).tolist():
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+
+
+def count_by_label(boxes, names):
+    """Count boxes per class label."""
+    class_ids, counts = np.unique(boxes[:, 5].astype(np.int64), return_counts=True)
+    return {names[class_id]: count for class_id, count in zip(class_ids.tolist(), counts.tolist())}
+
+
+def match_heads_to_motorcycles(head_boxes, motorcycle_boxes, max_distance=HEAD_TO_MOTORCYCLE_DISTANCE):
+    """
+    Associate heads with motorcycles using one pairwise distance matrix of their centers.
+
+    Returns, for every motorcycle, the index of the first head within max_distance
+    of it, or -1 if there is none.
+    """
+    if len(head_boxes) == 0 or len(motorcycle_boxes) == 0:
+        return np.full(len(motorcycle_boxes), -1, dtype=np.int64)
+    offsets = box_centers(motorcycle_boxes)[:, None, :] - box_centers(head_boxes)[None, :, :]
+    close = np.hypot(offsets[..., 0], offsets[..., 1]) < max_distance
+    return np.where(close.any(axis=1), close.argmax(axis=1), -1)
+
+
+def process_cattle(frame, boxes):
+    """Process detections for 'Cattle on Road'."""
+    cattle_boxes = filter_boxes(boxes, CATTLE_CLASS_IDS)
+    # Draw bounding box
+    draw_boxes(frame, cattle_boxes)
+    return frame, cattle_boxes
+
+
+# Object trackers of the cameras with the Tracking option. With inference
+# workers all frames of a camera go to the same worker, which tracks them.
+trackers = TrackerRegistry()
+
+
+def new_tracks(context, rule, boxes):
+    """
+    Return the boxes that start a new object track for the rule on the frame's
+    camera, or all boxes if the camera does not track objects.
+    """
+    if not context.frame_data.get("tracking"):
+        return boxes
+    track_ids, new = trackers.get(context.frame_data["camera_id"], rule).update(boxes)
+    return boxes[new]
+
+
+def parse_frame_message(body):
+    """
+    Deserialize a message from the frames queue and decode its frame. Frames
+    sent through shared memory are read in place as read-only arrays.
+    """
+    frame_data = unpack_message(body)
+    frame_data["frame_envelope"] = frame_data["frame"]
+    age = capture_age(frame_data)
+    if age is not None:
+        STAGE_SECONDS.observe(age, stage="queue")
+    if is_shm_descriptor(frame_data["frame"]):
+        frame = get_frame_reader().read(frame_data["frame"])
+        if frame is None:
+            CAMERA_FRAMES.inc(camera=frame_data["camera_id"], step="overwritten")
+            raise ValueError(f"Frame {frame_data['frame']['sequence']} of camera {frame_data['camera_id']} was overwritten before it was read")
+        frame_data["frame"] = frame
+    else:
+        with STAGE_SECONDS.time(stage="frame_decode"):
+            frame_data["frame"] = decode_frame(frame_data["frame"])
+    return frame_data
+
+
+class DetectionContext:
+    """
+    Detections for one frame, memoized per model so that every rule shares them.
+
+    Each model's output is stored as an (N, 6) array of
+    [x1, y1, x2, y2, score, class_id] in frame coordinates, with the model's class names.
+    """
+
+    def __init__(self, frame_data):
+        self.frame_data = frame_data
+        self.frame = frame_data["frame"]
+        # The camera's general model input size, None for the backend default
+        self.inference_size = frame_data.get("inference_size")
+        self._detections = {}
+
+    def has(self, name):
+        return name in self._detections
+
+    def set(self, name, boxes, names):
+        self._detections[name] = (boxes, names)
+
+    def get(self, name):
+        """Return (boxes, names) for the model, running it on this frame if needed."""
+        if name not in self._detections:
+            run_detector(name, [self])
+        return self._detections[name]
+
+
+def get_detector(name):
+    return models.get(name)
+
+
+def expand_box(box, margins, width, height):
+    """
+    Grow a box by (left, top, right, bottom) fractions of its size and clip it to the frame.
+    """
+    x1, y1, x2, y2 = box
+    box_width, box_height = x2 - x1, y2 - y1
+    left, top, right, bottom = margins
+    return (
+        max(0, int(x1 - left * box_width)),
+        max(0, int(y1 - top * box_height)),
+        min(width, int(x2 + right * box_width)),
+        min(height, int(y2 + bottom * box_height)),
+    )
+
+
+def run_detector(name, contexts):
+    """
+    Run one model as a single batched forward pass over the frames that need it.
+
+    The general model sees full frames at the camera's inference size, its
+    detections outside the camera's region of interest are dropped. Specialist models only see crops of the
+    general model's vehicle detections, and their boxes are mapped back to
+    frame coordinates. A frame without any matching vehicle costs no inference.
+    """
+    contexts = [context for context in contexts if not context.has(name)]
+    if not contexts:
+        return
+    detector = get_detector(name)
+
+    crop_rule = SPECIALIST_CROPS.get(name)
+    if crop_rule is None:
+        # One forward pass per inference size in the batch
+        by_size = {}
+        for context in contexts:
+            by_size.setdefault(context.inference_size, []).append(context)
+        for size, group in by_size.items():
+            with STAGE_SECONDS.time(stage=f"inference_{name}"):
+                results = detector.detect([context.frame for context in group], size=size)
+            for context, boxes in zip(group, results):
+                # Only keep detections inside the camera's region of interest
+                boxes = filter_boxes_by_roi(boxes, context.frame_data.get("roi"), context.frame.shape)
+                context.set(name, boxes, detector.names)
+        return
+
+    crops, owners = [], []
+    for context in contexts:
+        context.set(name, np.empty((0, 6), dtype=np.float32), detector.names)
+        vehicle_boxes, vehicle_names = context.get("general")
+        vehicle_boxes = filter_boxes(vehicle_boxes, label_ids(vehicle_names, crop_rule["classes"]))
+        height, width = context.frame.shape[:2]
+        for x1, y1, x2, y2 in vehicle_boxes[:, :4].tolist():
+            cx1, cy1, cx2, cy2 = expand_box((x1, y1, x2, y2), crop_rule["margins"], width, height)
+            if cx2 - cx1 < MIN_CROP_SIZE or cy2 - cy1 < MIN_CROP_SIZE:
+                continue
+            crops.append(context.frame[cy1:cy2, cx1:cx2])
+            owners.append((context, cx1, cy1))
+    if not crops:
+        return
+
+    boxes_by_context = {}
+    with STAGE_SECONDS.time(stage=f"inference_{name}"):
+        results = detector.detect(crops)
+    for (context, offset_x, offset_y), boxes in zip(owners, results):
+        boxes = boxes.copy()
+        boxes[:, [0, 2]] += offset_x
+        boxes[:, [1, 3]] += offset_y
+        boxes_by_context.setdefault(id(context), (context, []))[1].append(boxes)
+    for context, parts in boxes_by_context.values():
+        context.set(name, np.concatenate(parts), detector.names)
+
+
+def detect_batch(contexts):
+    """
+    Run each model once over the batch, on the frames whose rules need it.
+    """
+    for name, rule in DETECTOR_RULES.items():
+        run_detector(name, [context for context in contexts if rule is None or rule in context.frame_data["object_list"]])
+
+
+def apply_rules(context, processed_channel):
+    """
+    Apply the camera's detection rules to one frame and publish the analytics event.
+
+    Args:
+        context: The DetectionContext of the frame.
+        processed_channel: RabbitMQ channel for sending processed frames.
+    """
+    frame_data = context.frame_data
+    camera_id = frame_data["camera_id"]
+    camera_ip = frame_data["camera_ip"]
+    object_list = frame_data["object_list"]
+    datetime = frame_data["datetime"]
+    frame_envelope = frame_data["frame_envelope"]
+    frame = frame_data["frame"]
+    if is_shm_descriptor(frame_envelope):
+        # The sender may have reused the slot while the models ran
+        if not get_frame_reader().is_current(frame_envelope):
+            CAMERA_FRAMES.inc(camera=camera_id, step="overwritten")
+            log_error(f"Frame of camera {camera_id} was overwritten during inference, skipping it")
+            return
+        # Draw on a copy, the shared frame belongs to the sender
+        frame = frame.copy()
+    user_id = frame_data["user_id"]
+    credit_id = frame_data["credit_id"]
+    #print("Frame data :", frame_data)
+    # Detect and classify objects in the frame
+    detected_object = {}
+    flag = 0
+    object_for_detection = object_list
+
+    if not object_for_detection:
+        return frame, detected_object, flag
+    
+    boxes, names = context.get("general")
+    selected = filter_boxes(boxes, label_ids(names, object_for_detection))
+    if len(new_tracks(context, "objects", selected)):
+        flag = 1
+        draw_boxes(frame, selected)
+        detected_object.update(count_by_label(selected, names))
+        log_info(f"Detected object with label ans camera_id : {camera_id}")
+
+    if "Cattle on road" in object_for_detection:
+        #print("Cattle on road")
+        frame, cattle_boxes = process_cattle(frame, boxes)
+        if len(new_tracks(context, "cattle", cattle_boxes)):
+            flag = 1
+            detected_object["Cattle"] = len(cattle_boxes)
+            log_info(f"Cattle detected successfully for camera_id : {camera_id}")
+
+    # Specific Rules: Without Seat Belt
+    if "Without Seat belt" in object_for_detection:
+        #print("Without Seat belt")
+        seat_boxes, seat_names = context.get("seat_belt")  # Only run on car and truck crops
+        no_seat_belt = filter_boxes(seat_boxes, label_ids(seat_names, ("no-seatbelt",)))
+        if len(new_tracks(context, "seat_belt", no_seat_belt)):
+            flag = 1
+            publish_to_queue(camera_id, frame, processed_channel,processed_queue_name="detected_vehicle")
+            draw_boxes(frame, no_seat_belt)
+            detected_object["Without Seat belt"] = len(no_seat_belt)
+            log_info(f"Seat belt detected successfully for camera_id : {camera_id}")  
+
+
+    # Specific Rules: Without Helmet
+    if "Without Helmet" in object_for_detection:
+        #print("Without Helmet")
+        helmet_boxes, helmet_names = context.get("helmet")  # Only run on motorcycle crops
+        head_boxes = filter_boxes(helmet_boxes, label_ids(helmet_names, ("head",)))
+        if len(head_boxes):
+            log_info(f"Head detected with camera_id :{camera_id}")
+
+        # Check for motorcycles below detected HEADs, reusing the general detections
+        motorcycle_boxes = filter_boxes(boxes, label_ids(names, ("motorcycle",)))
+        head_index = match_heads_to_motorcycles(head_boxes, motorcycle_boxes)
+        riders = head_index >= 0
+        if len(new_tracks(context, "helmet", motorcycle_boxes[riders])):
+            # Publish to queue and annotate frame
+            flag = 1
+            publish_to_queue(camera_id, frame, processed_channel,processed_queue_name="detected_vehicle")
+            detected_object["Without Helmet"] = int(riders.sum())
+            draw_boxes(frame, motorcycle_boxes[riders])
+            draw_boxes(frame, head_boxes[head_index[riders]], color=(255, 0, 0))
+            log_info(f"Motorcycle detected with camera_id :{camera_id}")
+    # Serialize the processed license plate frame
+    #print("Detected object :", detected_object)
+    #print("object :", object_for_detection)
+    if detected_object:
+        image_info = {
+            "Event_Type":"Analytics",
+            "CameraId": camera_id,
+            'CameraIp': camera_ip,
+            'Datetime': datetime,
+            'Image': encode_frame(frame, **get_envelope_settings(frame_envelope)),  # Same settings the camera sent
+            'Object': detected_object,
+            "UserId": user_id,
+            "CreditId": credit_id,
+            "CaptureTime": frame_data.get("capture_time"),
+        }
+        serialized_frame = pack_message(image_info)
+        # Send the processed frame to the 'processed_frames' queue
+        processed_channel.basic_publish(
+            exchange="",
+            routing_key="video_analytics",
+            body=serialized_frame
+        )
+        CAMERA_FRAMES.inc(camera=camera_id, step="event")
+        log_info("Object detected successfully")
+
+
+def process_batch(bodies, processed_channel, processed_queue_name, rabbitmq_host):
+    """
+    Process a batch of frames received from RabbitMQ, possibly from several cameras.
+    """
+    if not processed_channel.is_open:
+        log_error("Receiver channel is closed. Attempting to reconnect.")
+        processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
+
+    run_batch(bodies, processed_channel)
+
+
+def run_batch(bodies, processed_channel):
+    """
+    Decode, detect and apply the rules to a batch of frames. Events are
+    published through processed_channel; errors are logged per frame.
+    """
+    contexts = []
+    for body in bodies:
+        try:
+            frame_data = parse_frame_message(body)
+        except Exception as e:
+            log_exception(f"Error decoding frame: {e}")
+            continue
+        # Skip cameras that have no rules to evaluate
+        if frame_data["object_list"]:
+            contexts.append(DetectionContext(frame_data))
+    if not contexts:
+        return
+
+    try:
+        detect_batch(contexts)
+    except Exception as e:
+        log_exception(f"Error running inference on batch of {len(contexts)} frames: {e}")
+        return
+
+    for context in contexts:
+        CAMERA_FRAMES.inc(camera=context.frame_data["camera_id"], step="analysed")
+        try:
+            with STAGE_SECONDS.time(stage="rules"):
+                apply_rules(context, processed_channel)
+        except Exception as e:
+            log_exception(f"Error processing frame: {e}")
+
+
+class MessageCollector:
+    """
+    Stands in for the processed channel inside inference workers. The
+    consumer publishes the collected messages before it acks the frames.
+    """
+    is_open = True
+
+    def __init__(self):
+        self.messages = []
+
+    def basic_publish(self, exchange, routing_key, body):
+        self.messages.append((exchange, routing_key, body))
+
+
+def _init_inference_worker(workers):
+    # Split the cores between the workers instead of every worker using all of them
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    models.threads = threads
+    REGISTRY.reset()  # Metrics go back to the consumer with each batch
+    if INFERENCE_BACKEND == "pytorch":
+        import torch
+        torch.set_num_threads(threads)
+        # Models inherited from the consumer were loaded cold, warm them up here
+        models.warmup = WARMUP_RUNS
+        models.warm_up()
+    else:
+        # ONNX Runtime and OpenVINO thread pools do not survive a fork, so
+        # these workers load their own models
+        models.clear()
+
+
+def infer_in_worker(bodies):
+    """Run a batch in an inference worker and return the messages to publish and its metrics."""
+    collector = MessageCollector()
+    run_batch(bodies, collector)
+    return collector.messages, REGISTRY.take_delta()
+
+
+def create_inference_worker(workers):
+    """
+    Start one inference worker process, workers being the size of the pool.
+    With the pytorch backend the consumer loads every model before forking,
+    so the workers share them copy on write instead of each loading its own;
+    with the other backends each worker loads the models its frames need.
+    """
+    if INFERENCE_BACKEND == "pytorch":
+        # Warming up starts torch's thread pools, which deadlock in a forked
+        # child, so the consumer loads models cold and the workers warm them up
+        models.warmup = 0
+        models.preload()
+    return ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_inference_worker,
+        initargs=(workers,),
+    )
+
+
+def create_inference_pool(workers):
+    """
+    Start the inference workers, one single process executor per worker.
+    Frames are sharded by camera, so each camera's object tracker sees all
+    of its frames, in order.
+    """
+    return [create_inference_worker(workers) for _ in range(workers)]
+
+
+def inference_shard(body, workers):
+    """Return the index of the inference worker of the frame's camera."""
+    return hash(unpack_message(body)["camera_id"]) % workers
+
+
+def consume_with_workers(connection, channel, processed_channel, queue_name, pool, workers, prefetch_count, batch_size, batch_timeout_ms):
+    """
+    Consume frames with manual acks and run inference in the worker pool.
+
+    Each batch is split by camera shard, so all frames of a camera go to the
+    same worker. At most prefetch_count frames are in flight. A batch is acked only after
+    its events were published, so frames of a crashed consumer or worker are
+    redelivered (at least once delivery). A frame that fails a second time is
+    dropped instead of being redelivered forever.
+
+    Returns the pool, in which a worker that died is replaced.
+    """
+    channel.basic_qos(prefetch_count=prefetch_count)
+    pending = []
+    state = {"flush_timer": None}
+
+    def finish(deliveries, future):
+        if not channel.is_open:
+            return  # The broker redelivers the frames of a closed channel
+        try:
+            messages, metrics_delta = future.result()
+        except Exception as e:
+            log_exception(f"Inference worker failed on {len(deliveries)} frames: {e}")
+            if isinstance(e, BrokenProcessPool) and pool[future.shard] is future.pool:
+                pool[future.shard] = create_inference_worker(workers)
+            for delivery_tag, redelivered in deliveries:
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=not redelivered)
+            return
+        REGISTRY.merge(metrics_delta)
+        for exchange, routing_key, body in messages:
+            processed_channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body)
+        for delivery_tag, redelivered in deliveries:
+            channel.basic_ack(delivery_tag=delivery_tag)
+
+    def flush():
+        state["flush_timer"] = None
+        if not pending:
+            return
+        batch = pending[:batch_size]
+        del pending[:batch_size]
+        shards = {}
+        for delivery_tag, redelivered, shard, body in batch:
+            shards.setdefault(shard, []).append((delivery_tag, redelivered, body))
+        for shard, frames in shards.items():
+            deliveries = [(delivery_tag, redelivered) for delivery_tag, redelivered, body in frames]
+            future = pool[shard].submit(infer_in_worker, [body for delivery_tag, redelivered, body in frames])
+            future.pool = pool[shard]
+            future.shard = shard
+            # Futures complete on the pool's thread, pika calls must happen on this one
+            future.add_done_callback(lambda done, deliveries=deliveries: connection.add_callback_threadsafe(functools.partial(finish, deliveries, done)))
+
+    def on_message(ch, method, properties, body):
+        try:
+            shard = inference_shard(body, len(pool))
+        except Exception as e:
+            log_exception(f"Dropping a frame that could not be read: {e}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        pending.append((method.delivery_tag, method.redelivered, shard, body))
+        if len(pending) >= batch_size:
+            if state["flush_timer"] is not None:
+                connection.remove_timeout(state["flush_timer"])
+            flush()
+        elif state["flush_timer"] is None:
+            state["flush_timer"] = connection.call_later(batch_timeout_ms / 1000.0, flush)
+
+    channel.basic_consume(queue=queue_name, on_message_callback=on_message, auto_ack=False)
+    channel.start_consuming()
+    return pool
+
+
+def process_frame(ch, method, properties, body, processed_channel,processed_queue_name, rabbitmq_host):
+    """
+    Callback function to process the received frames from RabbitMQ.
+
+    Args:
+        ch, method, properties: RabbitMQ parameters.
+        body: The serialized frame data received from the queue.
+        processed_channel: RabbitMQ channel for sending processed frames.
+    """
+    process_batch([body], processed_channel, processed_queue_name, rabbitmq_host)
+
+
+def consume_in_batches(connection, channel, queue_name, batch_size, batch_timeout_ms, on_batch, prefetch_count=None):
+    """
+    Consume frames from the queue and hand them to on_batch in groups.
+
+    A batch is flushed when it holds batch_size frames or batch_timeout_ms
+    after its first frame arrived, whichever comes first. Frames are acked
+    once on_batch returns, and the broker delivers at most prefetch_count
+    unacked frames (twice the batch size by default), so a slow detector
+    does not pile frames up in memory and a crash does not lose them.
+    If on_batch raises, the batch and the frames waiting behind it go back
+    on the queue and the consumer is cancelled before the error is raised.
+    """
+    pending = []  # (delivery tag, body)
+    channel.basic_qos(prefetch_count=prefetch_count or 2 * batch_size)
+    consumer_tag = channel.basic_consume(
+        queue=queue_name,
+        on_message_callback=lambda ch, method, properties, body: pending.append((method.delivery_tag, body)),
+        auto_ack=False
+    )
+    while channel.is_open:
+        if not pending:
+            # Block until the first frame of the next batch arrives
+            connection.process_data_events(time_limit=None)
+            if not pending:
+                continue
+        deadline = time.monotonic() + batch_timeout_ms / 1000.0
+        while len(pending) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            connection.process_data_events(time_limit=remaining)
+        batch = pending[:batch_size]
+        del pending[:batch_size]
+        try:
+            on_batch([body for delivery_tag, body in batch])
+        except Exception:
+            last_tag = (pending or batch)[-1][0]
+            if channel.is_open:
+                channel.basic_cancel(consumer_tag)
+                channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+            raise
+        # Frames arrive in delivery tag order, so this acks the whole batch
+        channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+
+
+def main(queue_name="all_frames", processed_queue_name="video_analytics", rabbitmq_host="rabbitmq", batch_size=BATCH_SIZE, batch_timeout_ms=BATCH_TIMEOUT_MS, inference_workers=INFERENCE_WORKERS, prefetch_count=PREFETCH_COUNT):
+    """
+    Main function to set up RabbitMQ connections for receiving and sending frames.
+
+    Args:
+        queue_name (str): The RabbitMQ queue to consume frames from. Defaults to 'video_frames'.
+        processed_queue_name (str): The RabbitMQ queue to send processed frames to. Defaults to 'processed_frames'.
+        batch_size (int): Maximum number of frames per batched inference. Defaults to BATCH_SIZE.
+        batch_timeout_ms (int): Maximum time to wait for a batch to fill. Defaults to BATCH_TIMEOUT_MS.
+        inference_workers (int): Inference worker processes, 0 runs inference in this process. Defaults to INFERENCE_WORKERS.
+        prefetch_count (int): Unacknowledged frames in flight with workers. Defaults to PREFETCH_COUNT.
+    """
+    start_metrics_server(METRICS_PORT)
+    inference_pool = create_inference_pool(inference_workers) if inference_workers > 0 else None
+    prefetch_count = prefetch_count or 2 * max(1, inference_workers) * max(1, batch_size)
+
+    # Set up RabbitMQ connection and channel for receiving frames
+    receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name,rabbitmq_host)
+
+    # Set up RabbitMQ connection and channel for sending processed frames
+    processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
+
+    # ---------------------------------------------------
+    if not receiver_channel.is_open:
+        log_error("Receiver channel is closed. Attempting to reconnect.")
+        receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
+    if not processed_channel.is_open:
+        log_error("Receiver channel is closed. Attempting to reconnect.")
+        processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)    
+
+    while True:
+        try:
+            if not receiver_channel.is_open:
+                log_error("Receiver channel is closed. Attempting to reconnect.")
+                time.sleep(25)
+                receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
+            if not processed_channel.is_open:
+                log_error("Receiver channel is closed. Attempting to reconnect.")
+                time.sleep(25)
+                processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
+
+            if inference_pool is not None:
+                log_info(f"Waiting for video frames with {inference_workers} inference workers, prefetch {prefetch_count}...")
+                inference_pool = consume_with_workers(
+                    receiver_connection, receiver_channel, processed_channel, queue_name, inference_pool,
+                    inference_workers, prefetch_count, max(1, batch_size), batch_timeout_ms
+                )
+                continue
+
+            if batch_size > 1:
+                log_info(f"Waiting for video frames in batches of up to {batch_size}...")
+                consume_in_batches(
+                    receiver_connection, receiver_channel, queue_name, batch_size, batch_timeout_ms,
+                    on_batch=lambda bodies: process_batch(bodies, processed_channel, processed_queue_name, rabbitmq_host),
+                    prefetch_count=prefetch_count
+                )
+                continue
+
+            receiver_channel.basic_consume(
+                queue=queue_name, 
+                on_message_callback=lambda ch, method, properties, body: process_frame(
+                    ch, method, properties, body, processed_channel,processed_queue_name, rabbitmq_host
+                ),
+                auto_ack=True
+            )
+            log_info("Waiting for video frames...")
+            receiver_channel.start_consuming()
+        
+        except pika.exceptions.ConnectionClosedByBroker as e:
+            log_error("Connection closed by broker, reconnecting...")
+            time.sleep(25)
+            receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name, rabbitmq_host)
+            processed_connection, processed_channel = setup_rabbitmq_connection(processed_queue_name, rabbitmq_host)
+        except Exception as e:
+            log_exception(f"Unexpected error: {e}")
+            time.sleep(25)
+            continue 
+
+if __name__ == "__main__":
+    # Start the receiver and sender
+    main()
@@ -1,242 +1,489 @@
-import pika
-import os
-import pickle  # To deserialize and serialize frames
-import time
-import cv2
-import requests
-import logging
-import datetime
-
-
-# MEDIA_FOLDER = os.path.join(os.getcwd(), "media")
-# if not os.path.exists(MEDIA_FOLDER):
-#     os.makedirs(MEDIA_FOLDER)
-
-save_frame = 'media'
-os.makedirs(save_frame, exist_ok=True)
-
-BaseUrl = 'https://vmspyapi.ajeevi.in'
-
-
-def send_log_to_rabbitmq(log_message):
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='rabbitmq',heartbeat=600))
-        channel = connection.channel()
-        channel.queue_declare(queue='anpr_logs')  # Declare the queue for logs
-        # Serialize the log message as JSON and send it to RabbitMQ
-        channel.basic_publish(
-            exchange='',
-            routing_key='anpr_logs',
-            body=pickle.dumps(log_message)
-        )
-        connection.close()
-    except Exception as e:
-        print(f"Failed to send log to RabbitMQ: {e}")
-
-# Wrapper functions for logging and sending logs to RabbitMQ
-def log_info(message):
-    logging.info(message)
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    message_data = {
-        "log_level" : "INFO",
-        "Event_Type":"Send Camera Details in Queue",
-        "Message":message,
-        "datetime" : current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)
-
-def log_error(message):
-    logging.info(message)
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    message_data = {
-        "log_level" : "ERROR",
-        "Event_Type":"Send Camera Details in Queue",
-        "Message":message,
-        "datetime" : current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)    
-
-def log_exception(message):
-    logging.error(message)
-    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    message_data = {
-        "log_level" : "EXCEPTION",
-        "Event_Type":"Send Camera Details in Queue",
-        "Message":message,
-        "datetime" : current_time,
-
-    }
-    send_log_to_rabbitmq(message_data)
-
-def push_detection_data_to_base_url(camera_ip, camera_id, object_count, object_detect, framePath, alert_type, user_id):
-    api_url = f'{BaseUrl}/api/CameraAlert/'
-    object_detect_str = " ".join(object_detect) if isinstance(object_detect, list) else str(object_detect)
-    payload = {
-        "cameraId": int(camera_id),
-        "framePath": framePath,
-        "objectName": object_detect_str,
-        "objectCount": object_count,
-        "alertStatus": alert_type,
-         "userid": user_id
-
-    }
-
-    headers = {"accept": "*/*", "Content-Type": "application/json",}
-    print("Last data received :", payload)
-    try:
-        response = requests.post(api_url, json=payload, headers=headers)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        print(f"Error pushing data to API: {e}")
-        #Logs(camera_ip, "Error", f"Error pushing data to API: {e}")
-        if e.response:
-            print(f"Response Content: {e.response.text}")
-
-api_url ="https://vmsccp.ajeevi.in/transaction_update"
- #api_url = os.getenv("CREDIT_URL")
-
-
-
-def post_data(api_url, credit_id, camera_id, event_id=4):
-    
-    payload = {
-        "event_credit_id": credit_id, 
-        "device_id": camera_id, 
-        "event_type_id":event_id
-    }
-    
-    try:
-        response = requests.post(api_url, json=payload)
-        response.raise_for_status()  # Raise an error for bad responses (4xx or 5xx)
-        #print("Data posted successfully:", response.json())
-        log_info("Data posted successfully")
-        return response
-    except requests.exceptions.RequestException as e:
-        #print("An error occurred:", e)
-        log_error(f"An error occurred {e}")
-        return None
-
-def setup_rabbitmq_connection(queue_name, retries=5, retry_delay=5):
-    """
-    Set up a RabbitMQ connection and declare the queue.
-    """
-    rabbitmq_host = "rabbitmq"
-    for attempt in range(retries):
-        try:
-            connection = pika.BlockingConnection(pika.ConnectionParameters(host="rabbitmq"))
-            channel = connection.channel()
-            channel.queue_declare(queue=queue_name)
-            #print(f"Connected to RabbitMQ at {rabbitmq_host}")
-            log_info(f"Connected to RabbitMQ at {rabbitmq_host}")
-            return connection, channel
-        except pika.exceptions.AMQPConnectionError as e:
-            #print(f"RabbitMQ connection failed (attempt {attempt+1}/{retries}): {e}")
-            log_error(f"RabbitMQ connection failed (attempt {attempt+1}/{retries}): {e}")
-            time.sleep(retry_delay)
-    raise Exception(log_exception(f"Could not connect to RabbitMQ after {retries} attempts"))
-
-predic = {}
-last_object_detected = None
-def write_analytics(ch, method, properties, body):
-    """
-    Callback function to process the received frames from RabbitMQ.
-
-    Args:
-        ch, method, properties: RabbitMQ parameters.
-        body: The serialized frame data received from the queue.
-        sheet: Excel sheet object to write logs data.
-        file_name: Name of the Excel file.
-    """
-    global last_object_detected
-    try:
-        # Deserialize the frame and metadata
-        analytics_data = pickle.loads(body)
-        event_type = analytics_data["Event_Type"]
-        camera_id = analytics_data["CameraId"]
-        camera_ip = analytics_data["CameraIp"]
-        datetime = analytics_data["Datetime"]
-        frame = analytics_data["Image"]
-        object_detected = analytics_data["Object"]
-        user_id = analytics_data["UserId"]
-        credit_id = analytics_data["CreditId"]
-        # Print the data to the console
-        print("Detected Object :", object_detected)
-
-        # Save the logs data to the Excel file  
-        # Save frame if MEDIA_FOLDER is set
-        # camera_folder = os.path.join(MEDIA_FOLDER, str(camera_ip))
-        # os.makedirs(camera_folder, exist_ok=True)
-        # filename = f"{datetime}.jpg"
-        # file_path = os.path.join(camera_folder, filename)
-
-        frame_dir = os.path.join(save_frame, str(camera_ip))
-        os.makedirs(frame_dir, exist_ok=True)
-        full_frame_path = os.path.join(os.getcwd(), frame_dir, f'{datetime}.jpg')
-        #cv2.imwrite(full_frame_path, frame)
-
-        # Calculate object count
-        object_count = sum(object_detected.values())
-        if object_detected != last_object_detected:
-            last_object_detected = object_detected.copy()
-            try:
-                cv2.imwrite(full_frame_path, frame)
-                post_data(api_url,credit_id, camera_id)
-                push_detection_data_to_base_url(camera_ip, camera_id, object_count, object_detected, full_frame_path, 'B', user_id)
-                #print("Image saved")
-                log_info("Image saved")
-                #Logs(camera_ip, "Success", "Image saved")
-            except Exception as e:
-                #print(f"Error saving image: {e}")
-                log_exception(f"Error saving image: {e}")
-                
-
-
-
-        
-    except Exception as e:
-        #print(f"Error processing frame: {e}")
-        log_exception(f"Error processing frame: {e}")
-
-def main(queue_name="video_analytics"):
-    """
-    Main function to set up RabbitMQ connections for receiving and sending frames.
-
-    Args:
-        queue_name (str): The RabbitMQ queue to consume frames from. Defaults to 'anpr_logs'.
-        excel_file_name (str): The name of the Excel file to save logs.
-    """
-    # Set up the Excel file
-    #workbook, sheet = setup_excel(excel_file_name)
-
-    # Set up RabbitMQ connection and channel for receiving frames
-    receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name)
-    if not receiver_connection.is_open:
-        log_error("Receiver channel is closed. Attempting to reconnect.")
-        connection, channel = setup_rabbitmq_connection(queue_name)
-
-
-    try:
-        # Start consuming frames from the 'anpr_logs' queue
-        receiver_channel.basic_consume(
-            queue=queue_name, 
-            on_message_callback=lambda ch, method, properties, body: write_analytics(
-                ch, method, properties, body
-            ),
-            auto_ack=True
-        )
-        print("Waiting for logs message...")
-        receiver_channel.start_consuming()
-    except Exception as e:
-        #print(f"An error occurred: {e}")
-        log_error(f"An error occurred: {e}")
-    finally:
-        # Close the connections when done
-        receiver_connection.close()
-        print("Receiver stopped. RabbitMQ connections closed.")
-        log_info("Receiver stopped. RabbitMQ connections closed.")
-
-if __name__ == "__main__":
-    # Start the receiver
-    main()
+import pika
+import os
+import time
+import cv2
+import requests
+import logging
+import datetime
+import random
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from frame_codec import decode_frame, is_frame_envelope
+from remote_logging import get_remote_logger
+from event_dedup import EventDeduplicator
+from video_capture import grab_frame
+from message_schema import pack_message, unpack_message
+from metrics import CAMERA_FRAMES, END_TO_END_SECONDS, STAGE_SECONDS, capture_age, counter, start_metrics_server
+
+
+# MEDIA_FOLDER = os.path.join(os.getcwd(), "media")
+# if not os.path.exists(MEDIA_FOLDER):
+#     os.makedirs(MEDIA_FOLDER)
+
+save_frame = 'media'
+os.makedirs(save_frame, exist_ok=True)
+
+BaseUrl = 'https://vmspyapi.ajeevi.in'
+
+
+# Logger that also ships records to RabbitMQ, in batches from a background thread
+logger = get_remote_logger("write_analytics", "Send Camera Details in Queue")
+
+# Wrapper functions for logging and sending logs to RabbitMQ
+def log_info(message):
+    logger.info(message)
+
+def log_error(message):
+    logger.error(message)
+
+def log_exception(message):
+    logger.error(message, extra={"log_level": "EXCEPTION"})
+
+# Alert delivery settings
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "8"))
+DELIVERY_TIMEOUT = 10
+DELIVERY_RETRIES = 3
+DELIVERY_BACKOFF = 0.5
+DELIVERY_MAX_BACKOFF = 10
+# Durable queue for alerts that could not be delivered, retried every RETRY_INTERVAL seconds
+RETRY_QUEUE_NAME = "alert_delivery_retry"
+RETRY_INTERVAL = 60
+RETRY_MAX_REQUEUES = 10
+# Port of the /metrics endpoint
+METRICS_PORT = 9103
+# Fanout exchange on which the sender sends the main streams of cameras analysed on a substream
+SNAPSHOT_SOURCES_EXCHANGE = "snapshot_sources"
+ALERT_DELIVERIES = counter("vms_alert_deliveries", "Alert deliveries by outcome", ("outcome",))
+
+
+class AlertDelivery:
+    """
+    Deliver the alert HTTP requests off the consumer thread.
+
+    Requests run on a bounded thread pool and share a pooled requests.Session,
+    so connections to the APIs are reused. Failed requests are retried with
+    jittered exponential backoff. Requests that still fail because of a
+    network error or a server error are parked in a durable queue and
+    retried later, so an API outage does not lose alerts or stall the consumer.
+    """
+
+    def __init__(self, workers=DELIVERY_WORKERS, rabbitmq_host="rabbitmq"):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="alert-delivery")
+        # Blocks the consumer only when this many requests are already waiting
+        self.in_flight = threading.BoundedSemaphore(workers * 4)
+        self.rabbitmq_host = rabbitmq_host
+        self.lock = threading.Lock()
+        self.connection = None
+        self.channel = None
+        threading.Thread(target=self._retry_loop, daemon=True).start()
+
+    def post(self, url, payload, headers=None, description="Alert", requeues=0, on_settled=None):
+        """
+        Queue a JSON POST request and return its future. on_settled is called
+        with True once the request was delivered, rejected or parked again,
+        or with False if it could not be parked.
+        """
+        request = {"url": url, "json": payload, "headers": headers, "description": description, "requeues": requeues}
+        self.in_flight.acquire()
+        future = self.executor.submit(self._deliver, request)
+        future.add_done_callback(lambda done: self.in_flight.release())
+        if on_settled is not None:
+            # _deliver returns False only when parking failed
+            future.add_done_callback(lambda done: on_settled(done.exception() is None and done.result() is not False))
+        return future
+
+    def _deliver(self, request):
+        status = None
+        for attempt in range(DELIVERY_RETRIES + 1):
+            try:
+                with STAGE_SECONDS.time(stage="http"):
+                    response = self.session.post(request["url"], json=request["json"], headers=request["headers"], timeout=DELIVERY_TIMEOUT)
+                response.raise_for_status()
+                ALERT_DELIVERIES.inc(outcome="delivered")
+                log_info(f"{request['description']} posted successfully")
+                return response
+            except requests.RequestException as e:
+                error = e
+                status = e.response.status_code if e.response is not None else None
+                if status is not None and 400 <= status < 500 and status != 429:
+                    # The request itself is wrong, sending it again will not help
+                    log_error(f"{request['description']} rejected: {e} {e.response.text}")
+                    ALERT_DELIVERIES.inc(outcome="rejected")
+                    return None
+            if attempt < DELIVERY_RETRIES:
+                time.sleep(random.uniform(0, min(DELIVERY_MAX_BACKOFF, DELIVERY_BACKOFF * 2 ** attempt)))
+        log_error(f"{request['description']} failed after {DELIVERY_RETRIES + 1} attempts: {error}")
+        ALERT_DELIVERIES.inc(outcome="parked")
+        return None if self._park(request) else False
+
+    def _get_channel(self):
+        if self.channel is None or not self.channel.is_open:
+            self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.rabbitmq_host, heartbeat=600))
+            self.channel = self.connection.channel()
+            self.channel.queue_declare(queue=RETRY_QUEUE_NAME, durable=True)
+        return self.channel
+
+    def _park(self, request):
+        """
+        Put a failed request on the durable retry queue. Returns False if it
+        could not be parked.
+        """
+        request = dict(request, requeues=request["requeues"] + 1)
+        if request["requeues"] > RETRY_MAX_REQUEUES:
+            log_error(f"{request['description']} dropped after {RETRY_MAX_REQUEUES} retry rounds")
+            ALERT_DELIVERIES.inc(outcome="dropped")
+            return True
+        try:
+            with self.lock:
+                self._get_channel().basic_publish(
+                    exchange="",
+                    routing_key=RETRY_QUEUE_NAME,
+                    body=pack_message(request),
+                    properties=pika.BasicProperties(delivery_mode=2)  # Persist across broker restarts
+                )
+        except Exception as e:
+            self.channel = None
+            log_exception(f"Could not park failed {request['description']} for retry: {e}")
+            return False
+        return True
+
+    def _settle_retry(self, channel, delivery_tag, settled):
+        """Ack a parked request once it is settled, otherwise put it back on the retry queue."""
+        try:
+            with self.lock:
+                if settled:
+                    channel.basic_ack(delivery_tag=delivery_tag)
+                else:
+                    channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        except Exception as e:
+            # The broker redelivers unacked requests once the channel is gone
+            log_exception(f"Could not settle a parked alert request: {e}")
+
+    def _retry_loop(self):
+        while True:
+            time.sleep(RETRY_INTERVAL)
+            requests_to_retry = []
+            try:
+                with self.lock:
+                    channel = self._get_channel()
+                    while True:
+                        # Parked requests stay on the queue until they are delivered or parked again
+                        method, properties, body = channel.basic_get(queue=RETRY_QUEUE_NAME, auto_ack=False)
+                        if method is None:
+                            break
+                        requests_to_retry.append((method.delivery_tag, unpack_message(body)))
+            except Exception as e:
+                self.channel = None
+                log_exception(f"Could not read the alert retry queue: {e}")
+            for delivery_tag, request in requests_to_retry:
+                self.post(
+                    request["url"], request["json"], request["headers"], request["description"], request["requeues"],
+                    on_settled=functools.partial(self._settle_retry, channel, delivery_tag)
+                )
+
+
+alert_delivery = None
+
+def get_alert_delivery():
+    global alert_delivery
+    if alert_delivery is None:
+        alert_delivery = AlertDelivery()
+    return alert_delivery
+
+
+def push_detection_data_to_base_url(camera_ip, camera_id, object_count, object_detect, framePath, alert_type, user_id):
+    api_url = f'{BaseUrl}/api/CameraAlert/'
+    object_detect_str = " ".join(object_detect) if isinstance(object_detect, list) else str(object_detect)
+    payload = {
+        "cameraId": int(camera_id),
+        "framePath": framePath,
+        "objectName": object_detect_str,
+        "objectCount": object_count,
+        "alertStatus": alert_type,
+         "userid": user_id
+
+    }
+
+    headers = {"accept": "*/*", "Content-Type": "application/json",}
+    print("Last data received :", payload)
+    return get_alert_delivery().post(api_url, payload, headers, description=f"Camera alert for camera {camera_id}")
+
+api_url ="https://vmsccp.ajeevi.in/transaction_update"
+ #api_url = os.getenv("CREDIT_URL")
+
+
+
+def post_data(api_url, credit_id, camera_id, event_id=4):
+    
+    payload = {
+        "event_credit_id": credit_id, 
+        "device_id": camera_id, 
+        "event_type_id":event_id
+    }
+    
+    return get_alert_delivery().post(api_url, payload, description=f"Credit transaction for camera {camera_id}")
+
+# Threads that encode and write alert images
+IMAGE_WRITE_WORKERS = int(os.getenv("IMAGE_WRITE_WORKERS", "4"))
+IMAGE_JPEG_QUALITY = 90
+# Threads that open camera main streams for full resolution alert snapshots
+SNAPSHOT_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "2"))
+
+
+class ImageStore:
+    """
+    Write alert images behind the consumer's back.
+
+    Images are encoded and written on a thread pool. The directories that
+    already exist are cached, so there is no makedirs call per event. Files
+    are written to a temporary name and renamed, so readers never see a
+    partial image. JPEG frames from analytics are written as they are,
+    without decoding and encoding them again. Snapshots from camera streams
+    have their own threads, so a slow camera does not hold up the images.
+    """
+
+    def __init__(self, workers=IMAGE_WRITE_WORKERS, snapshot_workers=SNAPSHOT_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-store")
+        self.snapshot_executor = ThreadPoolExecutor(max_workers=snapshot_workers, thread_name_prefix="snapshot")
+        self.in_flight = threading.BoundedSemaphore(workers * 8)
+        self.snapshots_in_flight = threading.BoundedSemaphore(snapshot_workers * 4)
+        self.known_dirs = set()
+        self.lock = threading.Lock()
+
+    def save(self, directory, filename, image, on_saved=None):
+        """
+        Queue an image (a frame envelope or an ndarray) to be written, and call
+        on_saved with the final path once it is on disk. Returns a future.
+        """
+        self.in_flight.acquire()
+        future = self.executor.submit(self._write, directory, filename, image, on_saved)
+        future.add_done_callback(lambda done: self.in_flight.release())
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def save_snapshot(self, directory, filename, source):
+        """
+        Queue a snapshot of a camera stream to be written, source being the
+        stream's {"url", "options"}. The snapshot is taken when a snapshot
+        thread gets to it, which can be seconds after the frame the event was
+        detected in. Snapshots are skipped while too many are waiting.
+        Returns a future, or None if the snapshot was skipped.
+        """
+        if not self.snapshots_in_flight.acquire(blocking=False):
+            log_error(f"Skipped snapshot {filename}, too many snapshots waiting")
+            return None
+        future = self.snapshot_executor.submit(self._write_snapshot, directory, filename, source)
+        future.add_done_callback(lambda done: self.snapshots_in_flight.release())
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        # Nobody waits on these futures, so errors from on_saved would be lost
+        error = future.exception()
+        if error is not None:
+            log_error(f"Error after saving image: {error!r}")
+
+    def _write_snapshot(self, directory, filename, source):
+        with STAGE_SECONDS.time(stage="snapshot"):
+            frame = grab_frame(source["url"], source.get("options"))
+        if frame is None:
+            log_error(f"Could not take snapshot {filename} from the camera's main stream")
+            return None
+        return self._write(directory, filename, frame, None)
+
+    def _ensure_dir(self, directory):
+        if directory in self.known_dirs:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            self.known_dirs.add(directory)
+
+    def _encode(self, image):
+        if is_frame_envelope(image) and image["codec"] == "jpeg":
+            return image["data"]
+        ok, buffer = cv2.imencode(".jpg", decode_frame(image), [cv2.IMWRITE_JPEG_QUALITY, IMAGE_JPEG_QUALITY])
+        if not ok:
+            raise ValueError("Could not encode image as JPEG")
+        return buffer.tobytes()
+
+    def _write(self, directory, filename, image, on_saved):
+        try:
+            self._ensure_dir(directory)
+            path = os.path.join(directory, filename)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with STAGE_SECONDS.time(stage="disk_write"):
+                with open(temp_path, "wb") as temp_file:
+                    temp_file.write(self._encode(image))
+                os.replace(temp_path, path)
+        except Exception as e:
+            log_exception(f"Error saving image: {e}")
+            return None
+        log_info("Image saved")
+        if on_saved is not None:
+            on_saved(path)
+        return path
+
+
+image_store = None
+
+def get_image_store():
+    global image_store
+    if image_store is None:
+        image_store = ImageStore()
+    return image_store
+
+
+def setup_rabbitmq_connection(queue_name, retries=5, retry_delay=5):
+    """
+    Set up a RabbitMQ connection and declare the queue.
+    """
+    rabbitmq_host = "rabbitmq"
+    for attempt in range(retries):
+        try:
+            connection = pika.BlockingConnection(pika.ConnectionParameters(host="rabbitmq"))
+            channel = connection.channel()
+            channel.queue_declare(queue=queue_name)
+            #print(f"Connected to RabbitMQ at {rabbitmq_host}")
+            log_info(f"Connected to RabbitMQ at {rabbitmq_host}")
+            return connection, channel
+        except pika.exceptions.AMQPConnectionError as e:
+            #print(f"RabbitMQ connection failed (attempt {attempt+1}/{retries}): {e}")
+            log_error(f"RabbitMQ connection failed (attempt {attempt+1}/{retries}): {e}")
+            time.sleep(retry_delay)
+    raise Exception(log_exception(f"Could not connect to RabbitMQ after {retries} attempts"))
+
+predic = {}
+# Per camera deduplication of events, with its counters logged every DEDUP_STATS_INTERVAL seconds
+event_dedup = EventDeduplicator()
+DEDUP_STATS_INTERVAL = 300
+last_dedup_stats = time.time()
+# Main stream {"url", "options"} by camera ID of the cameras analysed on a substream
+snapshot_sources = {}
+
+def update_snapshot_sources(ch, method, properties, body):
+    """Replace the snapshot sources with the ones the sender sent."""
+    global snapshot_sources
+    try:
+        sources = unpack_message(body)["Sources"]
+        snapshot_sources = {source["CameraId"]: {"url": source["Url"], "options": source["Options"]} for source in sources}
+    except Exception as e:
+        log_exception(f"Invalid snapshot sources message: {e}")
+
+def write_analytics(ch, method, properties, body):
+    """
+    Callback function to process the received frames from RabbitMQ.
+
+    Args:
+        ch, method, properties: RabbitMQ parameters.
+        body: The serialized frame data received from the queue.
+        sheet: Excel sheet object to write logs data.
+        file_name: Name of the Excel file.
+    """
+    global last_dedup_stats
+    try:
+        # Deserialize the frame and metadata
+        analytics_data = unpack_message(body)
+        event_type = analytics_data["Event_Type"]
+        camera_id = analytics_data["CameraId"]
+        camera_ip = analytics_data["CameraIp"]
+        datetime = analytics_data["Datetime"]
+        image = analytics_data["Image"]
+        object_detected = analytics_data["Object"]
+        user_id = analytics_data["UserId"]
+        credit_id = analytics_data["CreditId"]
+        # Print the data to the console
+        print("Detected Object :", object_detected)
+
+        # Save the logs data to the Excel file  
+        # Save frame if MEDIA_FOLDER is set
+        # camera_folder = os.path.join(MEDIA_FOLDER, str(camera_ip))
+        # os.makedirs(camera_folder, exist_ok=True)
+        # filename = f"{datetime}.jpg"
+        # file_path = os.path.join(camera_folder, filename)
+
+        frame_dir = os.path.join(os.getcwd(), save_frame, str(camera_ip))
+
+        # Calculate object count
+        object_count = sum(object_detected.values())
+        if time.time() - last_dedup_stats > DEDUP_STATS_INTERVAL:
+            last_dedup_stats = time.time()
+            log_info(f"Event deduplication: {event_dedup.stats()}")
+        age = capture_age(analytics_data, "CaptureTime")
+        if age is not None:
+            END_TO_END_SECONDS.observe(age, camera=camera_id)
+        alert = event_dedup.should_alert(camera_id, object_detected)
+        CAMERA_FRAMES.inc(camera=camera_id, step="alerted" if alert else "suppressed")
+        if alert:
+            def send_alerts(full_frame_path):
+                # Runs once the image is on disk
+                post_data(api_url,credit_id, camera_id)
+                push_detection_data_to_base_url(camera_ip, camera_id, object_count, object_detected, full_frame_path, 'B', user_id)
+
+            get_image_store().save(frame_dir, f'{datetime}.jpg', image, on_saved=send_alerts)
+            snapshot_source = snapshot_sources.get(camera_id)
+            if snapshot_source:
+                # The camera is analysed on its substream, keep a full resolution snapshot
+                # next to the alert image. It is taken now, not when the frame was captured.
+                get_image_store().save_snapshot(frame_dir, f'{datetime}_main.jpg', snapshot_source)
+                
+
+
+
+        
+    except Exception as e:
+        #print(f"Error processing frame: {e}")
+        log_exception(f"Error processing frame: {e}")
+
+def main(queue_name="video_analytics"):
+    """
+    Main function to set up RabbitMQ connections for receiving and sending frames.
+
+    Args:
+        queue_name (str): The RabbitMQ queue to consume frames from. Defaults to 'anpr_logs'.
+        excel_file_name (str): The name of the Excel file to save logs.
+    """
+    # Set up the Excel file
+    #workbook, sheet = setup_excel(excel_file_name)
+
+    # Set up RabbitMQ connection and channel for receiving frames
+    receiver_connection, receiver_channel = setup_rabbitmq_connection(queue_name)
+    if not receiver_connection.is_open:
+        log_error("Receiver channel is closed. Attempting to reconnect.")
+        connection, channel = setup_rabbitmq_connection(queue_name)
+
+
+    try:
+        # Keep the main streams of the cameras analysed on a substream, for alert snapshots
+        receiver_channel.exchange_declare(exchange=SNAPSHOT_SOURCES_EXCHANGE, exchange_type="fanout")
+        sources_queue = receiver_channel.queue_declare(queue="", exclusive=True).method.queue
+        receiver_channel.queue_bind(queue=sources_queue, exchange=SNAPSHOT_SOURCES_EXCHANGE)
+        receiver_channel.basic_consume(queue=sources_queue, on_message_callback=update_snapshot_sources, auto_ack=True)
+        # Start consuming frames from the 'anpr_logs' queue
+        receiver_channel.basic_consume(
+            queue=queue_name, 
+            on_message_callback=lambda ch, method, properties, body: write_analytics(
+                ch, method, properties, body
+            ),
+            auto_ack=True
+        )
+        print("Waiting for logs message...")
+        receiver_channel.start_consuming()
+    except Exception as e:
+        #print(f"An error occurred: {e}")
+        log_error(f"An error occurred: {e}")
+    finally:
+        # Close the connections when done
+        receiver_connection.close()
+        print("Receiver stopped. RabbitMQ connections closed.")
+        log_info("Receiver stopped. RabbitMQ connections closed.")
+
+if __name__ == "__main__":
+    start_metrics_server(METRICS_PORT)
+    # Start the receiver
+    main()